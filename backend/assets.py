@@ -0,0 +1,217 @@
+import base64
+import hashlib
+import os
+import re
+import shutil
+import threading
+import time
+from io import BytesIO
+from PIL import Image
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Generated images, stored once per content hash and served as /assets/<hash>.<ext>
+ASSET_ROOT = os.getenv("ASSET_DIR", "assets")
+
+# Widths offered as compressed editor previews, served as /assets/<hash>/<width>.<format>
+VARIANT_WIDTHS = [int(width) for width in os.getenv("ASSET_VARIANT_WIDTHS", "160,480,1024").split(",")]
+VARIANT_FORMATS = {"webp": ("WEBP", "image/webp"), "jpeg": ("JPEG", "image/jpeg")}
+VARIANT_QUALITY = int(os.getenv("ASSET_VARIANT_QUALITY", 80))
+
+# Assets unused for this long are removed, then the least recently used until the store fits
+ASSET_TTL = int(os.getenv("ASSET_TTL_SECONDS", 60 * 60 * 24 * 30))
+ASSET_MAX_BYTES = int(os.getenv("ASSET_MAX_MB", 2048)) * 1024 * 1024
+
+# Names are content hashes, so a cached copy never goes stale
+CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+MIME_TYPES = {"png": "image/png", "jpeg": "image/jpeg", "webp": "image/webp", "gif": "image/gif"}
+
+DIGEST_RE = re.compile(r"^[0-9a-f]{64}$")
+# /assets/<digest>.<ext> and /assets/<digest>/<width>.<format>
+ASSET_PATH_RE = re.compile(r"^/assets/([0-9a-f]{64})(?:\.(\w+)|/(\d+)\.(\w+))$")
+# References in html, relative or on any host for drafts saved before urls were relative
+ASSET_REF_RE = re.compile(r"(?:https?://[^/\s\"'()<>]+)?(/assets/[0-9a-f]{64}(?:\.\w+|/\d+\.\w+))")
+
+
+def sniff(data):
+    if data.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "png"
+    if data.startswith(b"\xff\xd8\xff"):
+        return "jpeg"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "webp"
+    if data[:6] in (b"GIF87a", b"GIF89a"):
+        return "gif"
+    return None
+
+
+def asset_path(digest, ext):
+    return os.path.join(ASSET_ROOT, f"{digest}.{ext}")
+
+
+def variant_path(digest, width, fmt):
+    return os.path.join(ASSET_ROOT, digest, f"{width}.{fmt}")
+
+
+def _touch(path):
+    # The mtime records the last use, garbage collection keeps recently used assets
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+    return path
+
+
+def _write(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def store_image(data):
+    # Browser-ready formats are stored as received, anything else is converted to PNG once
+    ext = sniff(data)
+    if ext is None:
+        output_buffer = BytesIO()
+        Image.open(BytesIO(data)).save(output_buffer, format="PNG")
+        data = output_buffer.getvalue()
+        ext = "png"
+
+    digest = hashlib.sha256(data).hexdigest()
+    path = asset_path(digest, ext)
+    if os.path.exists(path):
+        _touch(path)
+    else:
+        _write(path, data)
+
+    # Only the header is read for the size
+    with Image.open(BytesIO(data)) as image:
+        width, height = image.size
+    return {"digest": digest, "ext": ext, "mime_type": MIME_TYPES[ext], "width": width, "height": height}
+
+
+def find_asset(digest, ext):
+    if not DIGEST_RE.match(digest) or ext not in MIME_TYPES:
+        return None
+    path = asset_path(digest, ext)
+    return _touch(path) if os.path.exists(path) else None
+
+
+def find_original(digest):
+    for ext in MIME_TYPES:
+        path = asset_path(digest, ext)
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def variant(digest, width, fmt):
+    # Built on first request and kept next to the original; never upscaled
+    if not DIGEST_RE.match(digest) or width not in VARIANT_WIDTHS or fmt not in VARIANT_FORMATS:
+        return None
+
+    path = variant_path(digest, width, fmt)
+    if os.path.exists(path):
+        return _touch(path)
+
+    original = find_original(digest)
+    if original is None:
+        return None
+
+    pil_format = VARIANT_FORMATS[fmt][0]
+    with Image.open(original) as image:
+        image.thumbnail((width, width * 10))
+        if pil_format == "JPEG":
+            image = image.convert("RGB")
+        output_buffer = BytesIO()
+        image.save(output_buffer, format=pil_format, quality=VARIANT_QUALITY)
+
+    _write(path, output_buffer.getvalue())
+    return path
+
+
+def local_asset(url_path):
+    # File behind an /assets url path, or None
+    match = ASSET_PATH_RE.match(url_path)
+    if match is None:
+        return None
+    digest, ext, width, fmt = match.groups()
+    if ext:
+        return find_asset(digest, ext)
+    return variant(digest, int(width), fmt)
+
+
+def asset_urls(asset):
+    # Relative, so drafts don't depend on the host that generated them
+    url = f"/assets/{asset['digest']}.{asset['ext']}"
+    variants = [
+        {"width": width, "format": fmt, "url": f"/assets/{asset['digest']}/{width}.{fmt}"}
+        for width in VARIANT_WIDTHS
+        for fmt in VARIANT_FORMATS
+    ]
+    return url, variants
+
+
+def inline_assets(html):
+    # Asset references become data URIs, for renderers that can't reach this server
+    inlined = {}
+
+    def replace(match):
+        url_path = match.group(1)
+        if url_path not in inlined:
+            path = local_asset(url_path)
+            if path is None:
+                inlined[url_path] = match.group(0)
+            else:
+                with open(path, "rb") as f:
+                    data = base64.b64encode(f.read()).decode("ascii")
+                inlined[url_path] = f"data:{MIME_TYPES[path.rsplit('.', 1)[1]]};base64,{data}"
+        return inlined[url_path]
+
+    return ASSET_REF_RE.sub(replace, html)
+
+
+def collect_garbage(max_age=ASSET_TTL, max_bytes=ASSET_MAX_BYTES):
+    # An original and its variants are used, kept and removed together
+    if not os.path.isdir(ASSET_ROOT):
+        return 0
+    groups = {}
+    for name in os.listdir(ASSET_ROOT):
+        digest = name[:64]
+        if not DIGEST_RE.match(digest):
+            continue
+        path = os.path.join(ASSET_ROOT, name)
+        paths = [os.path.join(path, child) for child in os.listdir(path)] if os.path.isdir(path) else [path]
+        group = groups.setdefault(digest, {"paths": [], "used": 0, "bytes": 0})
+        group["paths"].append(path)
+        for child in paths:
+            try:
+                stat = os.stat(child)
+            except OSError:
+                continue
+            group["used"] = max(group["used"], stat.st_mtime)
+            group["bytes"] += stat.st_size
+
+    cutoff = time.time() - max_age
+    total = sum(group["bytes"] for group in groups.values())
+    removed = 0
+    for group in sorted(groups.values(), key=lambda group: group["used"]):
+        if group["used"] >= cutoff and total <= max_bytes:
+            break
+        for path in group["paths"]:
+            if os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+            else:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+        total -= group["bytes"]
+        removed += 1
+    if removed:
+        print(f"Removed {removed} unused assets")
+    return removed
@@ -0,0 +1,67 @@
+"""Template cleaning by page count: the old outer-divs x pages cleaner against
+the page-at-a-time cleaner, sequential and on a process pool. Every variant's
+output is checked to be byte-identical to the old cleaner.
+
+Sequential cleaning measures about the same as the old cleaner, because later
+containers only find pages whose blocks were already moved. Any speedup comes
+from the pool, and only on machines with more than one core.
+
+Run from backend/: python -m benchmarks.clean_scaling [pages ...]
+"""
+import sys
+import time
+from bs4 import BeautifulSoup
+import generate_template
+import process_pools
+from generate_template import combine_text, clean_raw_html
+from benchmarks.sample_templates import converted_template
+
+
+def legacy_clean_raw_html(html):
+    extracted_html = BeautifulSoup(html, "html.parser")
+    clean_html = BeautifulSoup("<html><head></head><body></body></html>", "html.parser")
+    body = clean_html.body
+    body.attrs = extracted_html.body.attrs
+    for style_tag in extracted_html.find_all('style'):
+        clean_html.head.append(style_tag)
+
+    for outer in extracted_html.body.find_all("div", recursive=False):
+        outer_div = clean_html.new_tag("div", **outer.attrs)
+        for page in extracted_html.find_all("div", class_='page'):
+            page_div = clean_html.new_tag("div", **page.attrs)
+            for block in page.find_all(recursive=False):
+                combine_text(block)
+                page_div.append(block)
+            outer_div.append(page_div)
+        body.append(outer_div)
+
+    return clean_html.prettify()
+
+
+def timed(func, *args):
+    started = time.perf_counter()
+    result = func(*args)
+    return time.perf_counter() - started, result
+
+
+def main(page_counts, containers=3):
+    print(f"{'pages':>6} {'legacy':>9} {'sequential':>11} {'pool':>9} identical")
+    for pages in page_counts:
+        raw_html = converted_template(pages, containers=containers)
+        legacy_time, expected = timed(legacy_clean_raw_html, raw_html)
+
+        generate_template.PARALLEL_MIN_PAGES = float("inf")
+        sequential_time, sequential = timed(clean_raw_html, raw_html)
+
+        generate_template.PARALLEL_MIN_PAGES = 1
+        process_pools.get_pool("clean", generate_template.CLEAN_WORKERS)
+        pool_time, pooled = timed(clean_raw_html, raw_html)
+
+        identical = sequential == expected and pooled == expected
+        print(f"{pages:>6} {legacy_time:>8.3f}s {sequential_time:>10.3f}s {pool_time:>8.3f}s {identical}")
+
+    process_pools.shutdown_pools()
+
+
+if __name__ == "__main__":
+    main([int(arg) for arg in sys.argv[1:]] or [10, 50, 100, 200])
@@ -0,0 +1,125 @@
+"""The template pipeline as it was before it kept a single parsed tree.
+
+Copied verbatim from the baseline generate_template and generate_content
+(minus logging) so the benchmark measures the old code, not the new
+functions called in the old order. It always used html.parser.
+"""
+from bs4 import BeautifulSoup
+from generate_template import combine_text
+
+
+def clean_raw_html(html: str) -> str:
+    extracted_html = BeautifulSoup(html, "html.parser")
+
+    # Prepare the cleaned HTML structure
+    clean_html = BeautifulSoup("<html><head></head><body></body></html>", "html.parser")
+    body = clean_html.body
+    body.attrs = extracted_html.body.attrs
+
+    # Find all <style> tags from the original
+    style_tags = extracted_html.find_all('style')
+
+    # Append them into the <head> of the new HTML
+    new_head = clean_html.head
+    for style_tag in style_tags:
+        new_head.append(style_tag)
+
+
+    # Loop through all page containers
+    for outer in extracted_html.body.find_all("div", recursive=False):
+
+      outer_div = clean_html.new_tag("div", **outer.attrs)
+
+      for page in extracted_html.find_all("div", class_='page'):
+
+          page_div = clean_html.new_tag("div", **page.attrs)
+
+          for block in page.find_all(recursive=False):
+
+              combine_text(block)
+              page_div.append(block)
+
+          outer_div.append(page_div)
+
+      body.append(outer_div)
+
+    return clean_html.prettify()
+
+
+def remove_images_and_styles(cleaned_html):
+    template = BeautifulSoup(cleaned_html, "html.parser")
+    img_srcs = []
+    for image in template.body.find_all("img"):
+        img_srcs.append(image.get('src'))
+        image['src'] = ''
+
+    all_styles = []
+
+    for tag in template.body.find_all():
+        all_styles.append(tag.get("style"))
+    
+    return template, img_srcs, all_styles
+
+
+def check_output(llm_output, num_tags):
+
+    start = llm_output.find("<body")
+    end = llm_output.find("</body>")
+
+    if not (start > -1 and end > -1):
+        return False
+
+    output_template = BeautifulSoup(llm_output[start:end+7], "html.parser").body
+
+    count = 0
+    for tag in output_template.find_all():
+        count += 1
+    if num_tags != count:
+        return False
+    
+    return True
+
+
+def add_images_and_styles_with_content(template, llm_output, img_srcs, all_styles):
+
+    start = llm_output.find('<body')
+    end = llm_output.find('</body>') + len('</body>')
+
+    new_body = BeautifulSoup(llm_output[start:end], "html.parser").body
+
+    template.body.replace_with(new_body)
+
+    return restore_images_and_styles(template, img_srcs, all_styles)
+
+
+def restore_images_and_styles(template, img_srcs, all_styles):
+
+    count = 0
+    for image in template.body.find_all("img"):
+        image['src'] = img_srcs[count]
+        count+=1
+
+    count = 0
+    for tag in template.body.find_all():
+        tag_style = all_styles[count]
+
+        if 'class' in tag.attrs:
+            if 'page' not in tag['class']:
+                tag_style = all_styles[count]
+                start = tag_style.find('height:')
+                end = tag_style[start:].find(';') + start
+                tag_style = tag_style.replace(tag_style[start:end], 'height: auto')
+                
+        tag['style'] = tag_style
+        count+=1
+    
+    return template
+
+
+def legacy_pipeline(raw_html, llm_output):
+    # clean -> prettify -> re-parse, parse llm output twice, prettify the result
+    cleaned_html = clean_raw_html(raw_html)
+    template, img_srcs, all_styles = remove_images_and_styles(cleaned_html)
+    check_output(llm_output, len(all_styles))
+    template = add_images_and_styles_with_content(template, llm_output, img_srcs, all_styles)
+    return template.prettify()
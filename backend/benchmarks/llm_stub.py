@@ -0,0 +1,118 @@
+"""Offline OpenAI-compatible chat completions server for load tests.
+
+Answers every prompt the pipeline sends with output that passes its checks:
+template bodies and pages come back with their placeholders filled, slot,
+outline and batch rewrite prompts get JSON, the no-template prompt gets a
+styled layout.
+Latency, streaming speed and the share of 429 and 500 responses are set with
+STUB_LATENCY, STUB_CHARS_PER_SECOND, STUB_RATE_LIMITED and STUB_ERRORS.
+
+Run from backend/: python -m benchmarks.llm_stub [port]
+then start the app or a load test with LLM_STUB_URL=http://127.0.0.1:<port>/v1
+"""
+import asyncio
+import json
+import os
+import random
+import re
+import sys
+import time
+import uuid
+from fastapi import FastAPI, Request # type: ignore
+from fastapi.responses import JSONResponse, StreamingResponse # type: ignore
+
+LATENCY = float(os.getenv("STUB_LATENCY", 0.5))
+CHARS_PER_SECOND = float(os.getenv("STUB_CHARS_PER_SECOND", 4000))
+RATE_LIMITED = float(os.getenv("STUB_RATE_LIMITED", 0))
+ERRORS = float(os.getenv("STUB_ERRORS", 0))
+
+CHUNK_CHARS = 64
+
+PLACEHOLDER_RE = re.compile(r"\{\{\s*(title|heading|body)\s*\}\}")
+
+FILLER = {
+    "title": "Quarterly Update",
+    "heading": "Team highlights",
+    "body": "The team shipped the new onboarding flow this quarter and cut setup time in half for new customers.",
+}
+
+LAYOUT = """<style>.wrap{width:790px;margin:0 auto;font-family:Georgia,serif}.hero{padding:40px;background:#1d3557;color:#fff}</style>
+<div class="wrap"><div class="hero"><h1>Quarterly Update</h1><p>{text}</p></div></div>"""
+
+app = FastAPI()
+
+
+def fill(html):
+    return PLACEHOLDER_RE.sub(lambda match: FILLER[match.group(1)], html)
+
+
+def reply(prompt):
+    if "Slots: " in prompt:
+        slots = json.loads(prompt[prompt.rindex("Slots: ") + 7:])
+        return json.dumps({slot["id"]: FILLER[slot["type"]] for slot in slots})
+    if "Texts: " in prompt:
+        texts = json.loads(prompt[prompt.rindex("Texts: ") + 7:])
+        return json.dumps({key: f"Rewritten: {text}" for key, text in texts.items()})
+    if "Pages: " in prompt:
+        pages = json.loads(prompt[prompt.rindex("Pages: ") + 7:])
+        return json.dumps({page: f"Part {page} of the story" for page in pages})
+    if "Return only the page div." in prompt:
+        return fill(prompt[prompt.index("<div", prompt.index("Return only the page div.")):])
+    if "single <style> tag" in prompt:
+        return LAYOUT.replace("{text}", FILLER["body"])
+    if "<body" in prompt:
+        return fill(prompt[prompt.index("<body"):])
+    return FILLER["body"]
+
+
+def completion(model, text):
+    return {
+        "id": f"chatcmpl-{uuid.uuid4().hex}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+        "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+    }
+
+
+async def chunks(model, text):
+    chunk_id = f"chatcmpl-{uuid.uuid4().hex}"
+    for start in range(0, len(text), CHUNK_CHARS):
+        delta = text[start:start + CHUNK_CHARS]
+        payload = {
+            "id": chunk_id,
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "delta": {"content": delta}, "finish_reason": None}],
+        }
+        yield f"data: {json.dumps(payload)}\n\n"
+        await asyncio.sleep(len(delta) / CHARS_PER_SECOND)
+    yield "data: [DONE]\n\n"
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+
+    roll = random.random()
+    if roll < RATE_LIMITED:
+        return JSONResponse(status_code=429, content={"error": {"message": "Rate limited"}}, headers={"Retry-After": "1"})
+    if roll < RATE_LIMITED + ERRORS:
+        return JSONResponse(status_code=500, content={"error": {"message": "Stub error"}})
+
+    await asyncio.sleep(LATENCY)
+    text = reply(body["messages"][-1]["content"])
+    model = body.get("model", "stub")
+
+    if body.get("stream"):
+        return StreamingResponse(chunks(model, text), media_type="text/event-stream")
+    await asyncio.sleep(len(text) / CHARS_PER_SECOND)
+    return completion(model, text)
+
+
+if __name__ == "__main__":
+    import uvicorn # type: ignore
+
+    uvicorn.run(app, host="127.0.0.1", port=int(sys.argv[1]) if len(sys.argv) > 1 else 8100, log_level="warning")
@@ -0,0 +1,67 @@
+"""Load test of the templated pipeline against the offline LLM stub.
+
+Converts a sample pdf with the local converter and runs many generations at
+once through llm_router, reporting job latency and per-provider stats.
+
+Run from backend/ with the stub running (python -m benchmarks.llm_stub):
+LLM_STUB_URL=http://127.0.0.1:8100/v1 PDF_CONVERTER=local python -m benchmarks.load_pipeline [jobs] [concurrency] [pages]
+"""
+import asyncio
+import hashlib
+import sys
+import time
+import llm_router
+import workspace
+import http_client
+from pipeline import templated_pipeline
+from benchmarks.sample_templates import sample_pdf
+
+
+async def run_job(pdf_bytes, pages):
+    job_id = workspace.new_job_id()
+    pdf_path = workspace.upload_path(job_id, "template.pdf")
+    with open(pdf_path, "wb") as f:
+        f.write(pdf_bytes)
+    digest = hashlib.sha256(pdf_bytes).hexdigest()
+
+    started = time.perf_counter()
+    last = ""
+    try:
+        async for event in templated_pipeline(job_id, pdf_path, digest, f"sample-{pages}.pdf", "Quarterly update", "", "informative", True):
+            if event.startswith("data: Done|"):
+                last = event
+    finally:
+        workspace.remove_job(job_id)
+    return time.perf_counter() - started, "Error" not in last
+
+
+async def run(jobs, concurrency, pages):
+    if not llm_router.STUB_URL:
+        print("Set LLM_STUB_URL to the stub server, e.g. http://127.0.0.1:8100/v1")
+        return
+
+    pdf_bytes = sample_pdf(pages)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def limited():
+        async with semaphore:
+            return await run_job(pdf_bytes, pages)
+
+    started = time.perf_counter()
+    results = await asyncio.gather(*(limited() for _ in range(jobs)))
+    elapsed = time.perf_counter() - started
+
+    latencies = sorted(seconds for seconds, _ in results)
+    failed = sum(1 for _, ok in results if not ok)
+    p50 = latencies[len(latencies) // 2]
+    p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+    print(f"{jobs} jobs, {concurrency} at a time, {pages} pages: {elapsed:.2f}s total, "
+          f"{jobs / elapsed:.2f} jobs/s, p50 {p50:.2f}s, p95 {p95:.2f}s, {failed} failed")
+    print(llm_router.stats())
+    await http_client.shutdown()
+
+
+if __name__ == "__main__":
+    args = [int(arg) for arg in sys.argv[1:]]
+    jobs, concurrency, pages = (args + [50, 10, 3][len(args):])[:3]
+    asyncio.run(run(jobs, concurrency, pages))
@@ -0,0 +1,69 @@
+"""Latency and fidelity of the PDF-to-HTML converters.
+
+Fidelity is what the rest of the pipeline sees: page count, placeholder
+slots by type after cleaning, and how much of the PDF's text made it into
+the html. The remote converter only runs when CONVERT_API_SECRET is set.
+
+Run from backend/: python -m benchmarks.pdf_converters [pages ...]
+"""
+import asyncio
+import os
+import re
+import sys
+import tempfile
+import time
+from collections import Counter
+from bs4 import BeautifulSoup
+from generate_template import PDF_CONVERTERS, CONVERT_API_SECRET, clean_template
+from generate_content import remove_images_and_styles, extract_slots
+from benchmarks.sample_templates import sample_pdf
+import http_client
+
+WORD_RE = re.compile(r"\w+")
+
+
+def pdf_words(pdf_bytes):
+    import pymupdf # type: ignore
+
+    with pymupdf.open(stream=pdf_bytes, filetype="pdf") as document:
+        return Counter(WORD_RE.findall(" ".join(page.get_text() for page in document)))
+
+
+def fidelity(pdf_bytes, html_string):
+    template, _, _ = remove_images_and_styles(clean_template(html_string))
+    slots = extract_slots(template)
+
+    # Text recall is measured on the converted html before placeholders replace it
+    converted_words = Counter(WORD_RE.findall(BeautifulSoup(html_string, "html.parser").get_text(" ")))
+    expected = pdf_words(pdf_bytes)
+    recall = sum((converted_words & expected).values()) / max(1, sum(expected.values()))
+
+    return {
+        "pages": len(template.body.find_all("div", class_="page")),
+        "slots": dict(Counter(slot["type"] for slot in slots)),
+        "text_recall": round(recall, 3),
+    }
+
+
+async def run(page_counts):
+    converters = ["local"] + (["convertapi"] if CONVERT_API_SECRET else [])
+    for pages in page_counts:
+        pdf_bytes = sample_pdf(pages)
+        # Converters read from disk, the same way the pipeline hands them an upload
+        with tempfile.TemporaryDirectory() as directory:
+            pdf_path = os.path.join(directory, "template.pdf")
+            with open(pdf_path, "wb") as f:
+                f.write(pdf_bytes)
+            for name in converters:
+                started = time.perf_counter()
+                converted, html_string = await PDF_CONVERTERS[name](pdf_path, f"sample-{pages}.pdf")
+                elapsed = time.perf_counter() - started
+                if not converted:
+                    print(f"{pages:>4} pages {name:>10}: failed ({html_string})")
+                    continue
+                print(f"{pages:>4} pages {name:>10}: {elapsed:.3f}s {fidelity(pdf_bytes, html_string)}")
+    await http_client.shutdown()
+
+
+if __name__ == "__main__":
+    asyncio.run(run([int(arg) for arg in sys.argv[1:]] or [1, 10, 50]))
@@ -0,0 +1,64 @@
+import random
+
+PARAGRAPH_CLASSES = ["title", "heading-1", "heading-2", "body-text", "body-text", "table-paragraph", "list-paragraph"]
+
+
+def converted_template(pages, blocks_per_page=12, seed=0, containers=1):
+    # Html shaped like ConvertAPI pdf-to-html output: one container div of .page divs,
+    # each holding positioned blocks of classed paragraphs made of spans
+    rng = random.Random(seed)
+    out = [
+        "<html><head><style>.page{position:relative;width:794px;height:1123px}",
+        ".body-text{font-size:11pt}</style></head>",
+        '<body style="margin:0"><div id="page-container" style="width:794px">',
+    ]
+    for page in range(pages):
+        out.append(f'<div class="page" id="page-{page}" style="height:1123px;width:794px;">')
+        for block in range(blocks_per_page):
+            top = block * 90
+            out.append(f'<div class="block" style="position:absolute;top:{top}px;left:40px;height:80px;width:700px;">')
+            for line in range(rng.randint(1, 3)):
+                cls = rng.choice(PARAGRAPH_CLASSES)
+                words = " ".join(f"<span style=\"font-size:11pt;\">word{page}{block}{line}{w}</span>" for w in range(rng.randint(3, 12)))
+                out.append(f'<p class="p{line} {cls}" style="height:20px;margin:0;">{words}</p>')
+            if block % 5 == 0:
+                out.append(f'<img src="data:image/png;base64,{"A" * 200}" style="height:40px;width:40px;"/>')
+            out.append("</div>")
+        out.append("</div>")
+    out.append("</div>")
+    for extra in range(1, containers):
+        out.append(f'<div id="sidebar-{extra}" style="display:none"></div>')
+    out.append("</body></html>")
+    return "".join(out)
+
+
+def filled_output(template):
+    # Stands in for an llm reply: the stripped template body with every placeholder replaced
+    return "```html\n" + str(template.body).replace("{{ title }}", "A title").replace(
+        "{{ heading }}", "A heading").replace("{{ body }}", "Some body text for the newsletter.") + "\n```"
+
+
+def sample_pdf(pages, seed=0):
+    # A newsletter-like PDF (title, headings, body paragraphs, bullet lists) built with PyMuPDF
+    import pymupdf # type: ignore
+
+    rng = random.Random(seed)
+    document = pymupdf.open()
+    for number in range(pages):
+        page = document.new_page(width=595, height=842)
+        y = 60
+        if number == 0:
+            page.insert_text((50, y), "Company Newsletter", fontsize=28, fontname="hebo")
+            y += 50
+        for section in range(3):
+            page.insert_text((50, y), f"Section {number}.{section} heading", fontsize=16, fontname="hebo")
+            y += 28
+            for line in range(rng.randint(3, 5)):
+                page.insert_text((50, y), " ".join(f"word{w}" for w in range(12)), fontsize=11)
+                y += 15
+            y += 12
+            page.insert_text((60, y), "- a bullet point in a list", fontsize=11)
+            y += 30
+    data = document.tobytes()
+    document.close()
+    return data
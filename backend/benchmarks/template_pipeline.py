@@ -0,0 +1,60 @@
+"""Compares the old string round-trip template pipeline with the in-memory one.
+
+The legacy side is a copy of the baseline code in legacy_template_pipeline.
+
+Run from backend/: python -m benchmarks.template_pipeline [pages ...]
+"""
+import sys
+import time
+import tracemalloc
+from bs4 import BeautifulSoup
+from generate_template import clean_template
+from generate_content import (
+    remove_images_and_styles,
+    add_images_and_styles_with_content,
+    parse_output,
+    check_output_body,
+)
+from benchmarks.legacy_template_pipeline import legacy_pipeline
+from benchmarks.sample_templates import converted_template, filled_output
+
+
+def in_memory_pipeline(raw_html, llm_output, parser):
+    template, img_srcs, all_styles = remove_images_and_styles(clean_template(raw_html, parser))
+    output_body = parse_output(llm_output)
+    check_output_body(output_body, len(all_styles))
+    template = add_images_and_styles_with_content(template, output_body, img_srcs, all_styles)
+    return str(template)
+
+
+def measure(func, *args):
+    tracemalloc.start()
+    started = time.process_time()
+    func(*args)
+    cpu = time.process_time() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return cpu, peak
+
+
+def main(page_counts, parsers=("html.parser", "lxml")):
+    print(f"{'pages':>6} {'parser':>12} {'legacy cpu':>11} {'new cpu':>9} {'legacy peak':>12} {'new peak':>10}")
+    for pages in page_counts:
+        raw_html = converted_template(pages)
+        template, _, _ = remove_images_and_styles(clean_template(raw_html))
+        llm_output = filled_output(template)
+        # The old pipeline only ever used html.parser
+        legacy = measure(legacy_pipeline, raw_html, llm_output)
+
+        for parser in parsers:
+            try:
+                BeautifulSoup("", parser)
+            except Exception:
+                continue
+            new = measure(in_memory_pipeline, raw_html, llm_output, parser)
+            print(f"{pages:>6} {parser:>12} {legacy[0]:>10.3f}s {new[0]:>8.3f}s "
+                  f"{legacy[1] / 1e6:>10.1f}MB {new[1] / 1e6:>8.1f}MB")
+
+
+if __name__ == "__main__":
+    main([int(arg) for arg in sys.argv[1:]] or [5, 25, 100])
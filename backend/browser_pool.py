@@ -0,0 +1,184 @@
+import asyncio
+import ipaddress
+from contextlib import asynccontextmanager
+from urllib.parse import urlsplit
+from playwright.async_api import async_playwright  # type: ignore
+from dotenv import load_dotenv
+import assets
+import os
+
+load_dotenv()
+
+# Number of warm browser contexts, which is also the number of concurrent renders
+CONTEXTS = int(os.getenv("BROWSER_CONTEXTS", 4))
+# How long a render waits in line for a free context
+ACQUIRE_TIMEOUT = float(os.getenv("BROWSER_ACQUIRE_TIMEOUT", 30))
+# How often the lifespan task checks that the browser is still connected
+HEALTH_INTERVAL = float(os.getenv("BROWSER_HEALTH_INTERVAL", 30))
+
+
+async def is_public_host(host):
+    # Every address the host resolves to has to be globally routable: no loopback,
+    # private networks, link-local (cloud metadata) or reserved ranges
+    if not host:
+        return False
+    try:
+        addresses = [ipaddress.ip_address(host)]
+    except ValueError:
+        try:
+            infos = await asyncio.get_running_loop().getaddrinfo(host, None)
+        except OSError:
+            return False
+        addresses = [ipaddress.ip_address(info[4][0].split("%")[0]) for info in infos]
+    return bool(addresses) and all(address.is_global for address in addresses)
+
+
+async def filter_request(route):
+    # Rendered html comes from users: the app's own /assets are served from disk,
+    # public http(s) urls are fetched, anything else is never requested
+    url = urlsplit(route.request.url)
+    if url.scheme in ("http", "https"):
+        path = await asyncio.to_thread(assets.local_asset, url.path)
+        if path is not None:
+            await route.fulfill(path=path)
+            return
+        if await is_public_host(url.hostname):
+            await route.continue_()
+            return
+    elif url.scheme in ("data", "blob"):
+        await route.continue_()
+        return
+    await route.abort("blockedbyclient")
+
+
+class BrowserPool:
+    def __init__(self, size=CONTEXTS):
+        self.size = size
+        self.restarts = 0
+        self.renders = 0
+        self._playwright = None
+        self._browser = None
+        self._contexts = asyncio.Queue()
+        self._lock = asyncio.Lock()
+        # Bumped on every (re)start so contexts of a crashed browser are not handed out again
+        self._generation = 0
+
+    @property
+    def started(self):
+        return self._browser is not None
+
+    @property
+    def healthy(self):
+        return self._browser is not None and self._browser.is_connected()
+
+    async def start(self, stale_generation=None):
+        # stale_generation restarts a browser that still looks healthy, unless another caller already did
+        async with self._lock:
+            if self.healthy and self._generation != stale_generation:
+                return
+            if self._browser is not None:
+                self.restarts += 1
+                print("Browser unusable, restarting the pool")
+            await self._close()
+            self._playwright = await async_playwright().start()
+            self._browser = await self._playwright.chromium.launch()
+            self._generation += 1
+            for _ in range(self.size):
+                self._contexts.put_nowait((self._generation, await self._new_context()))
+            print(f"Browser pool started with {self.size} contexts")
+
+    async def restart(self, stale_generation=None):
+        # Concurrent callers restart the browser once, the rest find it healthy
+        await self.start(stale_generation)
+
+    async def stop(self):
+        async with self._lock:
+            await self._close()
+
+    async def _close(self):
+        if self._browser is not None:
+            try:
+                await self._browser.close()
+            except Exception as e:
+                print("Browser close failed:", str(e))
+        if self._playwright is not None:
+            await self._playwright.stop()
+        self._browser = None
+        self._playwright = None
+        # Drained rather than replaced, renders already waiting on the queue get the new contexts
+        while not self._contexts.empty():
+            self._contexts.get_nowait()
+
+    async def health_check(self):
+        if self.started and not self.healthy:
+            await self.restart()
+
+    async def health_loop(self, interval=HEALTH_INTERVAL):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.health_check()
+            except Exception as e:
+                print("Browser health check failed:", str(e))
+
+    async def _new_context(self):
+        context = await self._browser.new_context(service_workers="block")
+        await context.route("**/*", filter_request)
+        return context
+
+    async def _replace(self, generation, context):
+        # Every used context is swapped for a fresh one from the same browser, so no
+        # cookies, storage or cache carry over from one user's render to the next
+        try:
+            await context.close()
+        except Exception:
+            pass
+        for _ in range(2):
+            if generation != self._generation or not self.healthy:
+                return
+            try:
+                self._contexts.put_nowait((generation, await self._new_context()))
+                return
+            except Exception as e:
+                print("Replacing a browser context failed:", str(e))
+        # The browser can't make contexts any more, start over rather than run one short
+        await self.restart(generation)
+
+    @asynccontextmanager
+    async def page(self):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + ACQUIRE_TIMEOUT
+        while True:
+            if not self.started:
+                await self.start()
+            elif not self.healthy:
+                await self.restart()
+
+            generation, context = await asyncio.wait_for(self._contexts.get(), max(0, deadline - loop.time()))
+            if generation == self._generation and self.healthy:
+                break
+            # Context of a browser that crashed while it sat in the queue
+        try:
+            page = await context.new_page()
+            self.renders += 1
+            yield page
+        finally:
+            # Failures here are logged, never raised over the render's own result or error
+            try:
+                await self._replace(generation, context)
+                # Renders already waiting for a context are served by the restarted browser
+                await self.health_check()
+            except Exception as e:
+                print("Returning a browser context failed:", str(e))
+
+    def stats(self):
+        return {
+            "healthy": self.healthy,
+            "contexts": self.size,
+            "idle": self._contexts.qsize(),
+            "renders": self.renders,
+            "restarts": self.restarts,
+        }
+
+
+pool = BrowserPool()
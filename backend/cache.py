@@ -0,0 +1,203 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+def content_key(*parts):
+    digest = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, str):
+            part = part.encode("utf-8")
+        digest.update(len(part).to_bytes(8, "big"))
+        digest.update(part)
+    return digest.hexdigest()
+
+
+class DiskStore:
+    # One json file per key, evicted oldest-access-first once over max_bytes
+
+    suffix = ".json"
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}{self.suffix}")
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                record = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+        expires_at = record.get("expires_at")
+        if expires_at is not None and expires_at < time.time():
+            self.delete(key)
+            return None
+
+        os.utime(path)
+        return record["value"], expires_at
+
+    def set(self, key, value, expires_at=None):
+        path = self._path(key)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"expires_at": expires_at, "value": value}, f)
+        os.replace(tmp_path, path)
+        self._evict()
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def clear(self):
+        for name in os.listdir(self.directory):
+            if name.endswith(self.suffix):
+                os.remove(os.path.join(self.directory, name))
+
+    def _evict(self):
+        with self._lock:
+            files = []
+            total = 0
+            for name in os.listdir(self.directory):
+                if not name.endswith(self.suffix):
+                    continue
+                path = os.path.join(self.directory, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+                total += stat.st_size
+
+            files.sort()
+            for _, size, path in files:
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+
+
+class FileStore(DiskStore):
+    # Raw files handed out by path so they can be sent without being read into memory
+
+    def __init__(self, directory, max_bytes, suffix):
+        super().__init__(directory, max_bytes)
+        self.suffix = suffix
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return path
+
+    def set(self, key, data):
+        path = self._path(key)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        self._evict()
+        return path
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses}
+
+
+class LRUCache:
+    # Size-bounded in-memory LRU with optional TTL, backed by an optional store
+    # (e.g. DiskStore) that is read through on a memory miss.
+
+    def __init__(self, max_bytes, ttl=None, store=None):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.store = store
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, size, expires_at = entry
+                if expires_at is None or expires_at > time.time():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                self._remove(key)
+
+        if self.store is not None:
+            stored = self.store.get(key)
+            if stored is not None:
+                value, expires_at = stored
+                self._insert(key, value, expires_at)
+                with self._lock:
+                    self.hits += 1
+                return value
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def set(self, key, value):
+        expires_at = time.time() + self.ttl if self.ttl else None
+        self._insert(key, value, expires_at)
+        if self.store is not None:
+            self.store.set(key, value, expires_at)
+
+    def delete(self, key):
+        with self._lock:
+            self._remove(key)
+        if self.store is not None:
+            self.store.delete(key)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._size,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+    def _insert(self, key, value, expires_at):
+        size = len(json.dumps(value))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = (value, size, expires_at)
+            self._size += size
+            while self._size > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._size -= entry[1]
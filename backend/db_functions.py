@@ -1,6 +1,9 @@
 from fastapi import Request, HTTPException  # type: ignore
 from supabase import create_client, Client, ClientOptions  # type: ignore
-from playwright.async_api import async_playwright  # type: ignore
+import assets
+import browser_pool
+import asyncio
+import thumbnails
 from datetime import datetime, timezone
 import os
 import dotenv
@@ -13,16 +16,15 @@ service = os.getenv("SUPABASE_SERVICE_KEY")
 
 
 async def generate_thumbnail_from_html_string(
-    html: str, width: int = 800, height: int = 600
+    html: str, width: int = thumbnails.RENDER_WIDTH, height: int = thumbnails.RENDER_HEIGHT
 ) -> bytes:
-    async with async_playwright() as p:
-        browser = await p.chromium.launch()
-        page = await browser.new_page()
+    # Rendered on a warm context of the shared browser, no launch per save.
+    # Only the top of the page is captured, long newsletters don't grow the image.
+    html = await asyncio.to_thread(assets.inline_assets, html)
+    async with browser_pool.pool.page() as page:
         await page.set_viewport_size({"width": width, "height": height})
         await page.set_content(html, wait_until="load")
-        screenshot = await page.screenshot(full_page=True, type="png")
-        await browser.close()
-        return screenshot
+        return await page.screenshot(clip={"x": 0, "y": 0, "width": width, "height": height}, type="png")
 
 
 def get_user_db(token: str) -> Client:
@@ -30,6 +32,85 @@ def get_user_db(token: str) -> Client:
     return create_client(url, key, options=opts)
 
 
+def stored_thumbnail(proj_id, token):
+    user_db = get_user_db(token)
+    response = (
+        user_db.from_("latest files")
+        .select("thumbnail_path")
+        .eq("file_id", proj_id)
+        .execute()
+    )
+    return response.data[0] if response.data else None
+
+
+def upload_thumbnail(proj_id, thumbnail_path, encoded, previous_path, token):
+    user_db = get_user_db(token)
+    bucket = user_db.storage.from_("newsletter-thumbnails")
+    for (name, fmt), data in encoded.items():
+        bucket.upload(
+            file=data,
+            path=f"{thumbnail_path}/{name}.{fmt}",
+            file_options={
+                "content-type": thumbnails.FORMATS[fmt][1],
+                "cache-control": thumbnails.CACHE_CONTROL,
+                "upsert": "true",
+            },
+        )
+    response = (
+        user_db.table("latest files")
+        .update({"thumbnail_path": thumbnail_path})
+        .eq("file_id", proj_id)
+        .execute()
+    )
+    # Deleted while the thumbnail was rendering
+    if not response.data:
+        bucket.remove(thumbnails.thumbnail_files(thumbnail_path))
+        return False
+    if previous_path and previous_path != thumbnail_path:
+        bucket.remove(thumbnails.thumbnail_files(previous_path))
+    return True
+
+
+async def render_thumbnail(proj_id, html, token):
+    # The stored path ends in the html hash, so an unchanged save is skipped without a render
+    thumbnail_path = thumbnails.thumbnail_prefix(proj_id, thumbnails.thumbnail_key(html))
+    stored = await asyncio.to_thread(stored_thumbnail, proj_id, token)
+    if stored is None:
+        return thumbnails.DELETED
+    if stored.get("thumbnail_path") == thumbnail_path:
+        return thumbnails.UNCHANGED
+
+    screenshot = await generate_thumbnail_from_html_string(html=html)
+    encoded = await asyncio.to_thread(thumbnails.encode_thumbnails, screenshot)
+    uploaded = await asyncio.to_thread(upload_thumbnail, proj_id, thumbnail_path, encoded, stored.get("thumbnail_path"), token)
+    return thumbnails.RENDERED if uploaded else thumbnails.DELETED
+
+
+def thumbnail_urls(user_db, path):
+    bucket = user_db.storage.from_("newsletter-thumbnails")
+    if path.endswith(".png"):
+        url = bucket.get_public_url(path = path, options = {"download": False})
+        return url, {}
+    urls = {
+        name: {fmt: bucket.get_public_url(path = f"{path}/{name}.{fmt}", options = {"download": False}) for fmt in thumbnails.FORMATS}
+        for name in thumbnails.SIZES
+    }
+    return urls["list"]["webp"], urls
+
+
+thumbnail_queue = thumbnails.ThumbnailQueue(render_thumbnail)
+
+
+def thumbnail_status(row):
+    # Pending until the queued render is uploaded; rows without a render in flight use the stored path
+    status = thumbnail_queue.status(row["file_id"])
+    if status == "pending":
+        return "pending"
+    if row.get("thumbnail_path"):
+        return "ready"
+    return status or "missing"
+
+
 async def save_draft(request: Request):
     token = request.headers.get("authorization")
     if not token or not token.startswith("Bearer "):
@@ -44,8 +125,6 @@ async def save_draft(request: Request):
     project = data.get("projectData")
     html = data.get("html")
 
-    thumbnail = await generate_thumbnail_from_html_string(html=html)
-
     projID = data.get("projID")
     if projID == "null":
         projID = None
@@ -67,11 +146,6 @@ async def save_draft(request: Request):
 
             projID = response.data[0]["file_id"]
 
-            response = user_db.storage.from_("newsletter-thumbnails").upload(
-                file=thumbnail, path=f"{projID}.png", file_options={"content-type": "image/*","upsert": "true"}
-            )
-            thumbnail_path = f"{projID}.png"
-
             response = (
                 user_db.from_("latest files")
                 .insert(
@@ -80,7 +154,6 @@ async def save_draft(request: Request):
                         "file_id": projID,
                         "file_name": filename,
                         "project_data": project,
-                        "thumbnail_path": thumbnail_path
                     }
                 )
                 .execute()
@@ -100,10 +173,6 @@ async def save_draft(request: Request):
                 .execute()
             )
 
-            response = user_db.storage.from_("newsletter-thumbnails").upload(
-                file=thumbnail, path=f"{projID}.png", file_options={"content-type": "image/*","upsert": "true"}
-            )
-
             current_time = datetime.now(timezone.utc)
 
             response = (
@@ -120,13 +189,17 @@ async def save_draft(request: Request):
                 .execute()
             )
 
-        return projID
     except Exception as e:
         print("Exception:", e)
         if "JWT expired" in str(e):
             raise HTTPException(status_code=401, detail="User Session Timed Out")
         raise HTTPException(status_code=500, detail=f"Failed to create save: {str(e)}")
 
+    # The rows are committed, the thumbnail follows from the background queue
+    if html:
+        thumbnail_queue.submit(projID, html, token)
+    return projID
+
 
 async def get_newsletters(request: Request):
 
@@ -154,8 +227,10 @@ async def get_newsletters(request: Request):
         for i in range(len(rows)):
             path = rows[i]["thumbnail_path"]
             if path:
-                url = user_db.storage.from_("newsletter-thumbnails").get_public_url(path = path, options = {"download": False})
+                url, urls = thumbnail_urls(user_db, path)
                 rows[i]["thumbnail_url"] = url
+                rows[i]["thumbnail_urls"] = urls
+            rows[i]["thumbnail_status"] = thumbnail_status(rows[i])
 
         return rows
 
@@ -253,9 +328,10 @@ async def delete_files(request: Request):
                 user_db.from_("latest files").delete().eq("file_id", proj_id).execute()
             )
             thumbnail_path = response.data[0]["thumbnail_path"]
-            storage_response = (
-                user_db.storage.from_("newsletter-thumbnails").remove([thumbnail_path])
-            )
+            if thumbnail_path:
+                storage_response = (
+                    user_db.storage.from_("newsletter-thumbnails").remove(thumbnails.thumbnail_files(thumbnail_path))
+                )
             return response.data
 
     except Exception as e:
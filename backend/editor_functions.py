@@ -1,23 +1,93 @@
-import requests
-from PIL import Image
-from io import BytesIO
+import asyncio
 import base64
-from openai import OpenAI #type: ignore
+import json
 from dotenv import load_dotenv
+from http_client import get_http_client
+import llm_router
+import rewrite_cache
+import assets
 import os
 
 load_dotenv()
 
 API_URL = "https://ir-api.myqa.cc/v1/openai/images/generations"
 API_KEY = os.getenv("IMAGEROUTER_API_KEY")
-OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY")
+IMAGE_MODEL = "stabilityai/sdxl-turbo:free"
 
-client = OpenAI(
-    base_url="https://openrouter.ai/api/v1",
-    api_key=OPENROUTER_API_KEY,
-)
+# Upstream image generations running at once across all requests
+IMAGE_CONCURRENCY = int(os.getenv("IMAGE_CONCURRENCY", 4))
+IMAGE_MAX_VARIANTS = int(os.getenv("IMAGE_MAX_VARIANTS", 4))
+IMAGE_MAX_PROMPTS = int(os.getenv("IMAGE_MAX_PROMPTS", 8))
 
-def generate_image(user_prompt):
+# Blocks of a batch rewrite are packed into requests of at most this many
+# estimated input tokens (about four characters each) and blocks
+TEXT_BATCH_MAX_TOKENS = int(os.getenv("TEXT_BATCH_MAX_TOKENS", 3000))
+TEXT_BATCH_MAX_BLOCKS = int(os.getenv("TEXT_BATCH_MAX_BLOCKS", 40))
+TEXT_BATCH_CONCURRENCY = int(os.getenv("TEXT_BATCH_CONCURRENCY", 4))
+# Blocks accepted in one /text/batch request
+TEXT_BATCH_MAX_REQUEST_BLOCKS = int(os.getenv("TEXT_BATCH_MAX_REQUEST_BLOCKS", 200))
+# Single-text retries of blocks a batch answer dropped, running at once across all requests
+TEXT_RETRY_CONCURRENCY = int(os.getenv("TEXT_RETRY_CONCURRENCY", 4))
+
+# Primary model of the rewrite route, part of the rewrite cache key;
+# rewrites answered by a fallback model are not memoized
+REWRITE_MODEL = llm_router.primary_model("rewrite")
+
+image_metrics = {
+    "requests": 0,
+    "upstream": 0,
+    "coalesced": 0,
+    "failed": 0,
+}
+
+_image_semaphore = asyncio.Semaphore(IMAGE_CONCURRENCY)
+_retry_semaphore = asyncio.Semaphore(TEXT_RETRY_CONCURRENCY)
+_image_inflight = {}
+
+async def generate_image(user_prompt, variant=0):
+    # Callers asking for the same prompt and variant at the same time share one
+    # upstream generation; distinct variants of a prompt are separate generations
+    image_metrics["requests"] += 1
+    key = (" ".join(user_prompt.split()), variant)
+
+    task = _image_inflight.get(key)
+    if task is None:
+        task = asyncio.ensure_future(_generate_image_limited(user_prompt))
+        _image_inflight[key] = task
+        task.add_done_callback(lambda _: _image_inflight.pop(key, None))
+    else:
+        image_metrics["coalesced"] += 1
+    return await asyncio.shield(task)
+
+async def _generate_image_limited(user_prompt):
+    async with _image_semaphore:
+        image_metrics["upstream"] += 1
+        try:
+            return await fetch_image(user_prompt)
+        except Exception:
+            image_metrics["failed"] += 1
+            raise
+
+async def generate_images(prompts, variants=1):
+    # Yields (prompt index, variant, asset, error) as each generation finishes
+    jobs = [(index, prompt, variant) for index, prompt in enumerate(prompts) for variant in range(variants)]
+
+    async def run(index, prompt, variant):
+        try:
+            return index, variant, await generate_image(prompt, variant), None
+        except Exception as e:
+            print("Image generation failed:", str(e))
+            return index, variant, None, str(e)
+
+    tasks = [asyncio.create_task(run(*job)) for job in jobs]
+    try:
+        for finished in asyncio.as_completed(tasks):
+            yield await finished
+    finally:
+        for task in tasks:
+            task.cancel()
+
+async def fetch_image(user_prompt):
     headers = {
         "Authorization": f"Bearer {API_KEY}",
         "Content-Type": "application/json"
@@ -25,52 +95,178 @@ def generate_image(user_prompt):
 
     payload = {
         "prompt": user_prompt,
-        "model": "stabilityai/sdxl-turbo:free",
+        "model": IMAGE_MODEL,
         "quality": "auto"
     }
 
-    response = requests.post(API_URL, headers=headers, json=payload)
+    http = get_http_client()
+    response = await http.post(API_URL, headers=headers, json=payload)
     response.raise_for_status()
     data = response.json()
 
     result = data.get("data", [])[0]
-    image = None
 
     if "b64_json" in result:
         image_data = base64.b64decode(result["b64_json"])
-        image = Image.open(BytesIO(image_data))
     elif "url" in result:
-        image_response = requests.get(result["url"])
+        image_response = await http.get(result["url"])
         image_response.raise_for_status()
-        image = Image.open(BytesIO(image_response.content))
+        image_data = image_response.content
     else:
         raise ValueError("No image data found in response.")
 
-    # Always return base64-encoded PNG
-    output_buffer = BytesIO()
-    image.convert("RGB").save(output_buffer, format="PNG")
-    base64_str = base64.b64encode(output_buffer.getvalue()).decode("utf-8")
-    
-    return {
-        "image_base64": base64_str,
-        "mime_type": "image/png"
-    }
+    # Stored as received and served by URL, PNGs are never decoded or re-encoded
+    return await asyncio.to_thread(assets.store_image, image_data)
 
-def transformText(text, tone, custom_prompt=None):
+def rewrite_instruction(tone, custom_prompt=None):
+    if tone == 'Custom' and custom_prompt:
+        return custom_prompt
+    return f"Convert the following text to a {tone} tone"
+
+def strip_quotes(transformed):
+    transformed = transformed.strip()
+
+    # Remove surrounding quotes if present
+    if transformed.startswith(("'", '"')) and transformed.endswith(("'", '"')):
+        transformed = transformed[1:-1]
+
+    return transformed
+
+async def transformText(text, tone, custom_prompt=None, user=None, fresh=False):
+    # fresh skips the memoized rewrite and replaces it with a new variant
+    key = rewrite_cache.rewrite_key(text, tone, custom_prompt, REWRITE_MODEL)
+    if fresh:
+        rewrite_cache.metrics["fresh"] += 1
+    else:
+        cached = rewrite_cache.get_rewrite(user, key)
+        if cached is not None:
+            return cached
+
+    served = []
+    transformed = await rewrite_text(text, tone, custom_prompt, served)
+    if set(served) <= {REWRITE_MODEL}:
+        rewrite_cache.store_rewrite(user, key, transformed)
+    return transformed
+
+async def rewrite_text(text, tone, custom_prompt=None, served=None):
     if tone == 'Custom' and custom_prompt:
         prompt = f"""{custom_prompt}\n\nText:\n{text}\n\nRespond only with the rewritten version."""
     else:
         prompt = f"""Convert the following text to a {tone} tone:\n\n"{text}"\n\nRespond only with the rewritten version."""
 
-    response = client.chat.completions.create(
-        model="meta-llama/llama-3.3-8b-instruct:free",
-        messages=[{"role": "user", "content": prompt}]
-    )
+    response = await llm_router.chat("rewrite", [{"role": "user", "content": prompt}], served=served)
 
-    transformed = response.choices[0].message.content.strip()
+    return strip_quotes(response.choices[0].message.content)
 
-    # Remove surrounding quotes if present
-    if transformed.startswith(("'", '"')) and transformed.endswith(("'", '"')):
-        transformed = transformed[1:-1]
+def estimate_tokens(text):
+    return len(text) // 4 + 1
+
+def pack_texts(texts, max_tokens=TEXT_BATCH_MAX_TOKENS, max_blocks=TEXT_BATCH_MAX_BLOCKS):
+    # Greedy packing in order; a text over the budget on its own gets its own request
+    packs = []
+    current = []
+    used = 0
+    for key, text in texts.items():
+        tokens = estimate_tokens(text)
+        if current and (used + tokens > max_tokens or len(current) >= max_blocks):
+            packs.append(current)
+            current = []
+            used = 0
+        current.append(key)
+        used += tokens
+    if current:
+        packs.append(current)
+    return packs
+
+def batch_prompt(texts, tone, custom_prompt=None):
+    return f"""{rewrite_instruction(tone, custom_prompt)}. Rewrite each text in the JSON object below on its own.
+Return ONLY a JSON object mapping every key to its rewritten text, with no markdown and no other keys.
+Texts: {json.dumps(texts, ensure_ascii=False)}"""
+
+def parse_batch_output(llm_output, keys):
+    # Returns the rewrites that came back, missing or malformed keys are left out
+    start = llm_output.find("{")
+    end = llm_output.rfind("}")
+    if start < 0 or end < 0:
+        return {}
+    try:
+        rewritten = json.loads(llm_output[start:end+1])
+    except json.JSONDecodeError:
+        return {}
+    if not isinstance(rewritten, dict):
+        return {}
+    return {key: strip_quotes(rewritten[key]) for key in keys if isinstance(rewritten.get(key), str)}
+
+async def retry_text(text, tone, custom_prompt=None, served=None):
+    async with _retry_semaphore:
+        return await rewrite_text(text, tone, custom_prompt, served)
+
+async def transform_pack(texts, tone, custom_prompt=None, user=None):
+    served = []
+    if len(texts) == 1:
+        (key, text), = texts.items()
+        rewritten = {key: await rewrite_text(text, tone, custom_prompt, served)}
+    else:
+        response = await llm_router.chat("rewrite", [
+            {"role": "user", "content": batch_prompt(texts, tone, custom_prompt)}
+        ], served=served)
+        rewritten = parse_batch_output(response.choices[0].message.content, texts)
+
+        # Only the texts the batch answer dropped are retried, one request each
+        missing = [key for key in texts if key not in rewritten]
+        if missing:
+            print(f"Batch rewrite missed {len(missing)} of {len(texts)} texts, retrying them one by one")
+            retried = await asyncio.gather(*(retry_text(texts[key], tone, custom_prompt, served) for key in missing))
+            rewritten.update(zip(missing, retried))
+
+    if not set(served) <= {REWRITE_MODEL}:
+        return rewritten
+    for key, transformed in rewritten.items():
+        rewrite_cache.store_rewrite(user, rewrite_cache.rewrite_key(texts[key], tone, custom_prompt, REWRITE_MODEL), transformed)
+    return rewritten
+
+async def transform_batch(blocks, tone, custom_prompt=None, user=None, fresh=False):
+    # blocks is a list of (block id, text). Yields (block id, rewritten text, error)
+    # as each packed request finishes; identical texts are rewritten once and
+    # memoized rewrites are yielded before anything is sent.
+    texts = {}
+    block_ids = {}
+    keys = {}
+    for block_id, text in blocks:
+        normalized = text.strip()
+        if normalized not in keys:
+            keys[normalized] = str(len(keys))
+            texts[keys[normalized]] = text
+            block_ids[keys[normalized]] = []
+        block_ids[keys[normalized]].append(block_id)
+
+    if not fresh:
+        for key, text in list(texts.items()):
+            cached = rewrite_cache.get_rewrite(user, rewrite_cache.rewrite_key(text, tone, custom_prompt, REWRITE_MODEL))
+            if cached is not None:
+                del texts[key]
+                for block_id in block_ids[key]:
+                    yield block_id, cached, None
+    else:
+        rewrite_cache.metrics["fresh"] += len(texts)
+
+    semaphore = asyncio.Semaphore(TEXT_BATCH_CONCURRENCY)
+
+    async def run(pack):
+        async with semaphore:
+            try:
+                return pack, await transform_pack({key: texts[key] for key in pack}, tone, custom_prompt, user), None
+            except Exception as e:
+                print("Batch rewrite failed:", str(e))
+                return pack, {}, str(e)
 
-    return transformed
\ No newline at end of file
+    tasks = [asyncio.create_task(run(pack)) for pack in pack_texts(texts)]
+    try:
+        for finished in asyncio.as_completed(tasks):
+            pack, rewritten, error = await finished
+            for key in pack:
+                for block_id in block_ids[key]:
+                    yield block_id, rewritten.get(key), error
+    finally:
+        for task in tasks:
+            task.cancel()
@@ -0,0 +1,48 @@
+import asyncio
+from dotenv import load_dotenv
+from cache import FileStore, content_key
+from generate_template import PAGE_BREAK_CSS, PDF_EXPORTER
+import os
+
+load_dotenv()
+
+CACHE_DIR = os.getenv("EXPORT_CACHE_DIR", "export-cache")
+DISK_BYTES = int(os.getenv("EXPORT_CACHE_DISK_MB", 512)) * 1024 * 1024
+
+# Bump when the export options in convert_html_to_pdf change
+CACHE_VERSION = "1"
+
+_store = None
+_inflight = {}
+
+
+def get_store():
+    global _store
+    if _store is None:
+        _store = FileStore(CACHE_DIR, DISK_BYTES, ".pdf")
+    return _store
+
+
+def export_key(html_content, exporter=PDF_EXPORTER):
+    return content_key(CACHE_VERSION, exporter, "A4", PAGE_BREAK_CSS, html_content)
+
+
+async def _export(key, html_content, convert):
+    done = await convert(html_content)
+    if not done[0]:
+        return done
+    return True, await asyncio.to_thread(get_store().set, key, done[1])
+
+
+async def export_pdf(key, html_content, convert):
+    # Returns (True, path) to the cached pdf, converting once for concurrent identical exports
+    path = await asyncio.to_thread(get_store().get, key)
+    if path is not None:
+        return True, path
+
+    task = _inflight.get(key)
+    if task is None:
+        task = asyncio.ensure_future(_export(key, html_content, convert))
+        _inflight[key] = task
+        task.add_done_callback(lambda _: _inflight.pop(key, None))
+    return await asyncio.shield(task)
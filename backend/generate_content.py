@@ -1,31 +1,40 @@
-from bs4 import BeautifulSoup
-from openai import OpenAI #type: ignore
-import httpx
+from bs4 import BeautifulSoup, Tag
+import json
+import re
 from dotenv import load_dotenv
+import llm_router
+from workspace import output_html_path
+from generate_template import HTML_PARSER
 import os
 
 load_dotenv()
 
-API_KEY = os.getenv("OPENROUTER_API_KEY_2")
-GEMINI_KEY = os.getenv("GEMINI_KEY")
+# "html" sends the whole template body, "slots" sends only the text placeholders,
+# "pages" sends each page of the body on its own, sharing an outline of the whole newsletter
+CONTENT_MODE = os.getenv("CONTENT_MODE", "html")
+# Pages generated at the same time in "pages" mode
+PAGE_CONCURRENCY = int(os.getenv("CONTENT_PAGE_CONCURRENCY", 4))
 
-def remove_images_and_styles(filename):
-    try:
-        with open(f'{filename}.html', "r", encoding="utf-8") as f:
-            raw_html = f.read()
-    except UnicodeDecodeError:
-        with open(f'{filename}.html', "r", encoding="cp1252") as f:
-            raw_html = f.read()
+# A no-template layout has to open its <style> block within MAX_STYLE_PREFIX characters
+MAX_STYLE_PREFIX = int(os.getenv("LAYOUT_MAX_STYLE_PREFIX", 200))
+MAX_STYLE_CHARS = int(os.getenv("LAYOUT_MAX_STYLE_CHARS", 20000))
 
-    template = BeautifulSoup(raw_html, "html.parser")
-    img_srcs = []
-    for image in template.body.find_all("img"):
-        img_srcs.append(image.get('src'))
-        image['src'] = ''
+PLACEHOLDER_RE = re.compile(r"^\s*\{\{\s*(title|heading|body)\s*\}\}\s*$")
 
+def remove_images_and_styles(cleaned_html):
+    # Works on the cleaned tree in place; html strings are parsed first
+    if isinstance(cleaned_html, BeautifulSoup):
+        template = cleaned_html
+    else:
+        template = BeautifulSoup(cleaned_html, HTML_PARSER)
+
+    img_srcs = []
     all_styles = []
 
     for tag in template.body.find_all():
+        if tag.name == "img":
+            img_srcs.append(tag.get('src'))
+            tag['src'] = ''
         all_styles.append(tag.get("style"))
     
     return template, img_srcs, all_styles
@@ -44,93 +53,236 @@ Ensure the content is original, factually accurate, and engaging. Add examples o
     
     return prompt
 
-def get_content(template, formalised_content):
-
-    prompt = f"{formalised_content}\nReplace the template text with the newsletter ONLY REPLACE THE TEMPLATE STRINGS DO NOT ADD OR REMOVE STYLES OR TAGS " + str(template.body)
-
-    client = OpenAI(
-        base_url="https://generativelanguage.googleapis.com/v1beta/openai/",
-        api_key=GEMINI_KEY,
-        timeout = 60
-    )
-
-    headers = {
-        # "Authorization": f"Bearer {API_KEY}",
-        # "Content-Type": "application/json",
-        "HTTP-Referer": "http://127.0.0.1:8000/"
-    }
+def content_prompt(template, formalised_content):
+    return f"{formalised_content}\nReplace the template text with the newsletter ONLY REPLACE THE TEMPLATE STRINGS DO NOT ADD OR REMOVE STYLES OR TAGS " + str(template.body)
 
+async def stream_attempt(prompt, response_format, monitor, budget, on_delta, task="content", served=None):
+    # Returns the full output, or None if the attempt was cut off early
+    chunks = []
+    kwargs = {"response_format": response_format} if response_format else {}
+    stream = llm_router.stream(task, [{"role": "user", "content": prompt}], served=served, **kwargs)
+    # Closing the stream early closes the upstream response as well
+    try:
+        async for delta in stream:
+            chunks.append(delta)
+            on_delta(delta)
+
+            if monitor and not monitor.feed(delta):
+                print(f"Error: {monitor.error}, aborting attempt")
+                return None
+            if budget and not budget.spend(len(delta)):
+                print("Error: Output budget exhausted, aborting attempt")
+                return None
+    finally:
+        await stream.aclose()
+
+    return "".join(chunks)
+
+class TagCounter:
+    # Running count of the tags inside <body> as llm output streams in, so an
+    # attempt can be dropped once it has more tags than the template.
+
+    TAG_RE = re.compile(r"<(/?)([a-zA-Z][^\s/>]*)")
+
+    def __init__(self, expected):
+        self.expected = expected
+        self.count = 0
+        self.in_body = False
+        self.body_closed = False
+        self._pending = ""
+
+    @property
+    def exceeded(self):
+        return self.count > self.expected
+
+    @property
+    def error(self):
+        return f"Output exceeded {self.expected} tags"
+
+    def feed(self, chunk):
+        self._pending += chunk
+        cut = self._pending.rfind(">") + 1
+        complete, self._pending = self._pending[:cut], self._pending[cut:]
+
+        for closing, name in self.TAG_RE.findall(complete):
+            name = name.lower()
+            if self.body_closed:
+                break
+            if name == "body":
+                self.in_body = not closing
+                self.body_closed = bool(closing)
+            elif self.in_body and not closing:
+                self.count += 1
+
+        return not self.exceeded
+
+def find_placeholders(template):
+    return template.body.find_all(string=PLACEHOLDER_RE)
+
+def extract_slots(template):
+    pages = template.body.find_all("div", class_="page")
+    page_numbers = {id(page): number for number, page in enumerate(pages, start=1)}
+
+    slots = []
+    for number, placeholder in enumerate(find_placeholders(template), start=1):
+        page = placeholder.find_parent("div", class_="page")
+        slots.append({
+            "id": str(number),
+            "type": PLACEHOLDER_RE.match(placeholder).group(1),
+            "page": page_numbers.get(id(page), 1),
+        })
+    return slots
+
+def slot_prompt(slots, formalised_content):
+
+    return f"""{formalised_content}
+The newsletter layout has the text slots listed below in reading order. Each slot has an id, a type (title, heading or body) and the page it is on.
+Write the text for every slot: short titles and headings, full paragraphs for body slots.
+Return ONLY a JSON object mapping every slot id to its text, with no markdown and no other keys.
+Slots: {json.dumps(slots, separators=(",", ":"))}"""
+
+def parse_slot_output(llm_output, slots):
+    start = llm_output.find("{")
+    end = llm_output.rfind("}")
+    if start < 0 or end < 0:
+        return None
 
     try:
-        llm_output = client.chat.completions.create(
-            model="gemini-2.5-flash",
-            extra_headers = headers,
-            messages=[
-                {"role": "user", "content": prompt}
-            ]
-        )
+        filled = json.loads(llm_output[start:end+1])
+    except json.JSONDecodeError:
+        return None
+
+    if not isinstance(filled, dict):
+        return None
+
+    for slot in slots:
+        if not isinstance(filled.get(slot["id"]), str):
+            return None
+    return filled
+
+def fill_slots(template, filled, slots):
+    if isinstance(filled, str):
+        filled = parse_slot_output(filled, slots)
+    for slot, placeholder in zip(slots, find_placeholders(template)):
+        placeholder.replace_with(filled[slot["id"]].strip())
+    return template
 
-    except httpx.HTTPStatusError as e:
-        print("HTTP error:", e.response.status_code)
-        print(e.response.text)  # See the raw response
-    except Exception as e:
-        print("Other error:", str(e))
+def split_pages(template):
+    return template.body.find_all("div", class_="page")
+
+def outline_prompt(slots, formalised_content):
+    pages = {}
+    for slot in slots:
+        counts = pages.setdefault(str(slot["page"]), {})
+        counts[slot["type"]] = counts.get(slot["type"], 0) + 1
+
+    return f"""{formalised_content}
+Before the newsletter is written page by page, plan it. The text slots on each page are counted below by type (title, heading or body).
+Write a short outline entry for every page: what it covers and how it follows on from the page before, so the pages read as one article.
+Return ONLY a JSON object mapping every page number to its outline entry, with no markdown and no other keys.
+Pages: {json.dumps(pages, separators=(",", ":"))}"""
+
+def parse_outline(llm_output, slots):
+    pages = {str(slot["page"]) for slot in slots}
+    return parse_slot_output(llm_output, [{"id": page} for page in pages])
+
+def page_prompt(page, number, total, outline, formalised_content):
+    return f"""{formalised_content}
+The newsletter is laid out over {total} pages and is being written one page at a time. Outline of the whole newsletter by page number:
+{json.dumps(outline, separators=(",", ":"))}
+Write page {number} only, following its outline entry.
+Replace the template text with the newsletter ONLY REPLACE THE TEMPLATE STRINGS DO NOT ADD OR REMOVE STYLES OR TAGS. Return only the page div.
+""" + str(page)
+
+def parse_page_output(llm_output, num_tags):
+    # num_tags counts the page div itself along with everything inside it
+    start = llm_output.find("<div")
+    end = llm_output.rfind("</div>")
+    if not (start > -1 and end > -1):
+        print("Error: Page div not found")
+        return None
 
-    return llm_output.choices[0].message.content
+    page = BeautifulSoup(llm_output[start:end+6], HTML_PARSER).find("div", class_="page")
+    if page is None:
+        print("Error: Page div not found")
+        return None
 
-def check_output(llm_output, num_tags):
+    count = len(page.find_all()) + 1
+    if num_tags != count:
+        print(f"Error: Number of tags mismatch on page (actual = {num_tags}, llm-output = {count})")
+        return None
+    return page
+
+def parse_pages_output(llm_output, pages):
+    # Cached "pages" output is the json list of every page's raw output
+    try:
+        outputs = json.loads(llm_output)
+    except json.JSONDecodeError:
+        return None
+    if not isinstance(outputs, list) or len(outputs) != len(pages):
+        return None
+
+    parsed = []
+    for output, page in zip(outputs, pages):
+        checked = parse_page_output(output, len(page.find_all()) + 1) if isinstance(output, str) else None
+        if checked is None:
+            return None
+        parsed.append(checked)
+    return parsed
+
+def parse_output(llm_output):
 
     start = llm_output.find("<body")
     end = llm_output.find("</body>")
 
     if not (start > -1 and end > -1):
         print("Error: Body tag not found")
-        return False
+        return None
+
+    return BeautifulSoup(llm_output[start:end+7], HTML_PARSER).body
 
-    output_template = BeautifulSoup(llm_output[start:end+7], "html.parser").body
+def check_output_body(output_body, num_tags):
 
-    count = 0
-    for tag in output_template.find_all():
-        count += 1
+    count = len(output_body.find_all())
     if num_tags != count:
         print(f"Error: Number of tags mismatch (actual = {num_tags}, llm-output = {count})")
         return False
     
     return True
-    
-def add_images_and_styles_with_content(template, llm_output, img_srcs, all_styles):
 
-    start = llm_output.find('<body')
-    end = llm_output.find('</body>') + len('</body>')
+def add_images_and_styles_with_content(template, llm_output, img_srcs, all_styles):
 
-    new_body = BeautifulSoup(llm_output[start:end], "html.parser").body
+    # llm_output may already be parsed by parse_output, or be the list of
+    # generated pages from "pages" mode, stitched back in template order
+    if isinstance(llm_output, list):
+        for page, new_page in zip(split_pages(template), llm_output):
+            page.replace_with(new_page)
+    else:
+        new_body = llm_output if isinstance(llm_output, Tag) else parse_output(llm_output)
+        template.body.replace_with(new_body)
 
-    template.body.replace_with(new_body)
+    return restore_images_and_styles(template, img_srcs, all_styles)
 
-    count = 0
-    for image in template.body.find_all("img"):
-        image['src'] = img_srcs[count]
-        count+=1
+def restore_images_and_styles(template, img_srcs, all_styles):
 
-    count = 0
-    for tag in template.body.find_all():
-        tag_style = all_styles[count]
+    images = iter(img_srcs)
+    for tag, tag_style in zip(template.body.find_all(), all_styles):
+        if tag.name == "img":
+            tag['src'] = next(images)
 
         if 'class' in tag.attrs:
             if 'page' not in tag['class']:
-                tag_style = all_styles[count]
                 start = tag_style.find('height:')
                 end = tag_style[start:].find(';') + start
                 tag_style = tag_style.replace(tag_style[start:end], 'height: auto')
                 
         tag['style'] = tag_style
-        count+=1
     
     return template
 
-def write_output(template):
-    with open("generated-html/output.html", "w", encoding="utf-8") as f:
-        f.write(template.prettify())
+def write_output(template, job_id):
+    with open(output_html_path(job_id), "w", encoding="utf-8") as f:
+        f.write(str(template))
 
 def clean_html_string(html_string):
     if html_string.startswith("```html"):
@@ -148,39 +300,71 @@ def isHTML(text):
     return "<style>" in lower and "</style>" in lower
 
 
-def no_template_generation(user_prompt, topic, tone):
-  
-    file_path = "generated-html"
-
-    pro_prompt = f"""You are an expert copywriter and HTML email designer. First, take the user's raw prompt that contains newsletter content (such as company information, announcements, goals, etc.) based on {topic} and rewrite it in a more {tone} tone. Maintain the original intent, meaning, and key points, but enhance clarity, tone, and grammar to match corporate or marketing communication standards. Do not remove any meaningful user-provided information—only reword it to sound better.
+class StyleChecker:
+    # Follows a no-template layout as it streams: a <style> block has to open
+    # near the start, close within max_style characters, and be the only one.
+
+    def __init__(self, max_prefix=MAX_STYLE_PREFIX, max_style=MAX_STYLE_CHARS):
+        self.max_prefix = max_prefix
+        self.max_style = max_style
+        self.state = "prefix"
+        self.error = None
+        self._text = ""
+        self._scanned = 0
+        self._start = 0
+
+    @property
+    def complete(self):
+        return self.state == "layout" and self.error is None
+
+    def _find(self, needle, start):
+        # Only rescans the few characters a tag split across chunks could start in
+        return self._text.find(needle, max(start, self._scanned - len(needle)))
+
+    def feed(self, chunk):
+        self._text += chunk.lower()
+
+        if self.state == "prefix":
+            start = self._find("<style", 0)
+            if start < 0:
+                if len(self._text) > self.max_prefix:
+                    self.error = "Output does not start with a <style> block"
+            else:
+                self.state, self._start = "style", start
+
+        if self.state == "style":
+            end = self._find("</style>", self._start)
+            if end < 0:
+                if len(self._text) - self._start > self.max_style:
+                    self.error = f"<style> block longer than {self.max_style} characters"
+            else:
+                self.state, self._start = "layout", end
+
+        if self.state == "layout" and self._find("<style", self._start) >= 0:
+            self.error = "Output has more than one <style> block"
+
+        self._scanned = len(self._text)
+        return self.error is None
+
+def polish_prompt(user_prompt, topic, tone):
+    return f"""You are an expert copywriter and HTML email designer. First, take the user's raw prompt that contains newsletter content (such as company information, announcements, goals, etc.) based on {topic} and rewrite it in a more {tone} tone. Maintain the original intent, meaning, and key points, but enhance clarity, tone, and grammar to match corporate or marketing communication standards. Do not remove any meaningful user-provided information—only reword it to sound better.
     User prompt is: {user_prompt} RETURN ONLY THE UPDATED PROMPT. DO NOT SAY ANYTHING ELSE. """
 
-    client = OpenAI(
-            base_url="https://openrouter.ai/api/v1",
-            api_key=API_KEY,
-            timeout = 60
-    )
-
-    headers = {
-        "HTTP-Referer": "http://127.0.0.1:8000/"
-    }
-
-    polish_response = client.chat.completions.create(
-        model="meta-llama/llama-3.3-8b-instruct:free",
-        extra_headers = headers,
-        messages=[
-            {
-                "role": "user",
-                "content": pro_prompt
-            }
-        ]
-    )
-
-    polished_prompt = polish_response.choices[0].message.content 
+async def polish_content(user_prompt, topic, tone):
+
+    polish_response = await llm_router.chat("polish", [
+        {
+            "role": "user",
+            "content": polish_prompt(user_prompt, topic, tone)
+        }
+    ])
+
+    polished_prompt = polish_response.choices[0].message.content
     print("Polished prompt: ",polished_prompt)
-    html_string = ""
-    while(not isHTML(html_string)):
-        generate_template=f"""Generate a visually appealing, responsive HTML newsletter layout approximately 790px wide and 1250px tall, using a professional
+    return polished_prompt
+
+def layout_prompt(polished_prompt):
+    return f"""Generate a visually appealing, responsive HTML newsletter layout approximately 790px wide and 1250px tall, using a professional
         design with clear structure and consistent spacing. Include the following: a company logo and name (top-left or centered), a navigation bar with 3–5 links, a hero section
         with heading, subtitle, and CTA button and a footer with social media icons and legal text. Use a randomly generated but cohesive color scheme and font pairing (serif/sans-serif) 
         to ensure visual appeal and contrast. Apply a single <style> tag at the top, no <html>, <head>, or <body> tags. Ensure layout is clean, well-aligned, 
@@ -190,37 +374,3 @@ def no_template_generation(user_prompt, topic, tone):
         with embedded CSS in a single <style> tag, no explanations or comments.
 
     """
-        client = OpenAI(
-            base_url="https://generativelanguage.googleapis.com/v1beta/openai/",
-            api_key=GEMINI_KEY,
-            timeout = 60
-        )
-        
-        html_response = client.chat.completions.create(
-        model="gemini-2.5-flash",
-        messages=[
-            {
-            "role": "user",
-            "content": generate_template
-            }
-        ]
-        )
-
-        if not os.path.exists(file_path): os.mkdir(file_path)
-        html_string = html_response.choices[0].message.content
-        html_string = clean_html_string(html_string)
-
-    print(html_string)
-    
-    try:
-        print(f"{file_path}/output.html")
-        print(os.path.exists(f"{file_path}/output.html"))
-        with open(f"{file_path}/output.html", "w", encoding="utf-8") as f:
-            
-            print(f.writable())
-            print(f"{file_path}/output.html")
-            print(os.path.exists(f"{file_path}/output.html"))
-            f.write(html_string)
-
-    except Exception as e:
-        print(e)
\ No newline at end of file
@@ -1,52 +1,80 @@
+import asyncio
 import base64
-import requests
+import itertools
 from bs4 import BeautifulSoup
 from dotenv import load_dotenv
+from http_client import get_http_client
+from workspace import CHUNK_SIZE, DEBUG_ARTIFACTS, write_debug_artifact
+from local_converter import convert_pdf_to_html_local
+import assets
+import browser_pool
+import process_pools
 import os
 
 load_dotenv()
 
 CONVERT_API_SECRET = os.getenv("CONVERT_API_SECRET")
 
-async def convert_pdf_to_html(fileBytes, filename):
+# Any parser BeautifulSoup supports, e.g. "lxml" for faster parsing of large templates
+HTML_PARSER = os.getenv("HTML_PARSER", "html.parser")
 
-    file_content = base64.b64encode(fileBytes).decode("utf-8")
+# Templates with at least this many pages are cleaned across a process pool
+CLEAN_WORKERS = int(os.getenv("CLEAN_WORKERS", os.cpu_count() or 1))
+PARALLEL_MIN_PAGES = int(os.getenv("CLEAN_PARALLEL_MIN_PAGES", 60))
 
-    payload = {
-        "Parameters": [
-            {
-                "Name": "File",
-                "FileValue": {
-                    "Name": filename,
-                    "Data": file_content
-                }
-            },
-            {
-                "Name": "StoreFile",
-                "Value": True
-            }
-        ]
-    }
+# "convertapi" uploads to ConvertAPI, "local" converts offline with PyMuPDF
+PDF_CONVERTER = os.getenv("PDF_CONVERTER", "convertapi")
+
+# "browser" renders exports in the pooled headless Chromium, "convertapi" uploads them
+PDF_EXPORTER = os.getenv("PDF_EXPORTER", "browser")
+
+PAGE_BREAK_CSS = ".page { break-after: page; } .page:last-of-type { break-after: auto; }"
+
+async def convert_pdf_to_html(pdf_path, filename, converter=None):
+    return await PDF_CONVERTERS[converter or PDF_CONVERTER](pdf_path, filename)
+
+async def convert_pdf_to_html_convertapi(pdf_path, filename):
 
     headers = {
-        "Authorization": f"Bearer {CONVERT_API_SECRET}",
-        "Content-type": "application/json"
+        "Authorization": f"Bearer {CONVERT_API_SECRET}"
     }
 
-    response = requests.post("https://v2.convertapi.com/convert/pdf/to/html", json=payload, headers=headers)
+    client = get_http_client()
+
+    # Multipart body is read from the file in chunks rather than base64 encoded in memory
+    with open(pdf_path, "rb") as f:
+        response = await client.post(
+            "https://v2.convertapi.com/convert/pdf/to/html",
+            files={"File": (filename, f, "application/pdf")},
+            data={"StoreFile": "true"},
+            headers=headers,
+        )
 
     if response.status_code == 200:
         download_url = response.json()["Files"][0]["Url"]
-        html_response = requests.get(download_url)
+
+        html_path = os.path.join(os.path.dirname(pdf_path), "converted.html")
+        async with client.stream("GET", download_url) as html_response:
+            html_response.raise_for_status()
+            with open(html_path, "wb") as out:
+                async for chunk in html_response.aiter_bytes(CHUNK_SIZE):
+                    await asyncio.to_thread(out.write, chunk)
         print("Conversion Successful")
-        with open(f"generated-html/{filename[:-4]}.html", "wb") as f:
-            f.write(html_response.content)
 
-        return True, None
+        return True, await asyncio.to_thread(read_html, html_path)
     else:
         return False, response
     
-async def convert_html_to_pdf(html_content: str):
+PDF_CONVERTERS = {
+    "convertapi": convert_pdf_to_html_convertapi,
+    "local": convert_pdf_to_html_local,
+}
+    
+async def convert_html_to_pdf(html_content: str, exporter=None):
+    html_content = await asyncio.to_thread(assets.inline_assets, html_content)
+    return await PDF_EXPORTERS[exporter or PDF_EXPORTER](html_content)
+
+async def convert_html_to_pdf_convertapi(html_content: str):
 
     file_content = base64.b64encode(html_content.encode("utf-8")).decode("utf-8")
 
@@ -83,17 +111,29 @@ async def convert_html_to_pdf(html_content: str):
         "Content-type": "application/json"
     }
 
-    response = requests.post("https://v2.convertapi.com/convert/html/to/pdf", json=payload, headers=headers)
+    client = get_http_client()
+    response = await client.post("https://v2.convertapi.com/convert/html/to/pdf", json=payload, headers=headers)
 
     if response.status_code == 200:
         download_url = response.json()["Files"][0]["Url"]
-        pdf_response = requests.get(download_url)
-        with open(f"generated-pdf/output.pdf", "wb") as f:
-            f.write(pdf_response.content)
-        return True, None
+        pdf_response = await client.get(download_url)
+        return True, pdf_response.content
     else:
         return False, response
 
+async def convert_html_to_pdf_browser(html_content: str):
+    # Same options as the ConvertAPI export: a page break after every .page, A4, no viewport
+    async with browser_pool.pool.page() as page:
+        await page.set_content(html_content, wait_until="load")
+        await page.add_style_tag(content=PAGE_BREAK_CSS)
+        pdf_bytes = await page.pdf(format="A4", print_background=True, prefer_css_page_size=False)
+    return True, pdf_bytes
+
+PDF_EXPORTERS = {
+    "convertapi": convert_html_to_pdf_convertapi,
+    "browser": convert_html_to_pdf_browser,
+}
+
 
 def combine_text(html_block):
     class_to_placeholder = {
@@ -124,11 +164,35 @@ def combine_text(html_block):
             combine_text(block)
     return -1
 
-def clean_raw_html(html: str) -> str:
-    extracted_html = BeautifulSoup(html, "html.parser")
+def clean_page(page):
+    for block in page.find_all(recursive=False):
+        combine_text(block)
+    return page.find_all(recursive=False)
+
+
+def clean_page_html(page_html, parser=HTML_PARSER):
+    # Runs in a pool worker: parse one page, fill its placeholders, send it back as text
+    page = BeautifulSoup(page_html, parser).find("div")
+    clean_page(page)
+    return str(page)
+
+
+def clean_pages(pages, parser):
+    # Each page is independent, so very large documents are spread over a process pool
+    if len(pages) < PARALLEL_MIN_PAGES or CLEAN_WORKERS < 2:
+        return [clean_page(page) for page in pages]
+
+    chunksize = max(1, len(pages) // (CLEAN_WORKERS * 4))
+    page_htmls = [str(page) for page in pages]
+    results = process_pools.get_pool("clean", CLEAN_WORKERS).map(clean_page_html, page_htmls, itertools.repeat(parser), chunksize=chunksize)
+    return [BeautifulSoup(result, parser).find("div").find_all(recursive=False) for result in results]
+
+
+def clean_template(html: str, parser: str = HTML_PARSER) -> BeautifulSoup:
+    extracted_html = BeautifulSoup(html, parser)
 
     # Prepare the cleaned HTML structure
-    clean_html = BeautifulSoup("<html><head></head><body></body></html>", "html.parser")
+    clean_html = BeautifulSoup("<html><head></head><body></body></html>", parser)
     body = clean_html.body
     body.attrs = extracted_html.body.attrs
 
@@ -140,43 +204,55 @@ def clean_raw_html(html: str) -> str:
     for style_tag in style_tags:
         new_head.append(style_tag)
 
+    # Every page is walked exactly once, in document order
+    pages = extracted_html.find_all("div", class_='page')
+    page_blocks = clean_pages(pages, parser)
 
-    # Loop through all page containers
-    for outer in extracted_html.body.find_all("div", recursive=False):
+    # Loop through all page containers. The blocks are moved into the first
+    # container, any later container only gets the empty page shells.
+    for index, outer in enumerate(extracted_html.body.find_all("div", recursive=False)):
 
       outer_div = clean_html.new_tag("div", **outer.attrs)
 
-      for page in extracted_html.find_all("div", class_='page'):
+      for page, blocks in zip(pages, page_blocks):
 
           page_div = clean_html.new_tag("div", **page.attrs)
 
-          for block in page.find_all(recursive=False):
-
-              combine_text(block)
-              page_div.append(block)
+          if index == 0:
+              for block in blocks:
+                  page_div.append(block)
 
           outer_div.append(page_div)
 
       body.append(outer_div)
 
-    return clean_html.prettify()
+    return clean_html
 
 
-def clean_html(filename):
+def clean_raw_html(html: str) -> str:
+    return clean_template(html).prettify()
 
+
+def decode_html(raw_bytes):
     try:
-        with open(f"{filename}.html", "r", encoding="utf-8") as f:
-            raw_html = f.read()
+        return raw_bytes.decode("utf-8")
     except UnicodeDecodeError:
-        with open(f"{filename}.html", "r", encoding="cp1252") as f:
-            raw_html = f.read()
+        return raw_bytes.decode("cp1252")
+
+
+def read_html(path):
+    with open(path, "rb") as f:
+        return decode_html(f.read())
+
 
-    cleaned_html= clean_raw_html(raw_html)
+def clean_html(raw_html, job_id):
 
-    cleaned_file = f"{filename}_cleaned"
+    cleaned = clean_template(raw_html)
 
-    with open(f"{cleaned_file}.html", "w", encoding="utf-8") as f:
-        f.write(cleaned_html)
+    # Only serialized when debugging, the pipeline keeps working on the tree
+    if DEBUG_ARTIFACTS:
+        write_debug_artifact(job_id, "template.html", raw_html)
+        write_debug_artifact(job_id, "template_cleaned.html", cleaned.prettify())
 
-    return(cleaned_file)
+    return cleaned
 
@@ -0,0 +1,149 @@
+import asyncio
+import time
+from collections import deque
+from dotenv import load_dotenv
+import os
+
+load_dotenv()
+
+# "sequential" retries one attempt at a time, "hedged" starts another attempt
+# once the current one is slower than HEDGE_PERCENTILE of recent attempts,
+# "parallel" starts HEDGE_PARALLEL attempts at once.
+STRATEGY = os.getenv("HEDGE_STRATEGY", "sequential")
+PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", 90))
+DEFAULT_DELAY = float(os.getenv("HEDGE_DEFAULT_DELAY", 30))
+PARALLEL = int(os.getenv("HEDGE_PARALLEL", 2))
+
+# Per-request cost cap: attempts started and characters streamed across all of them
+MAX_ATTEMPTS = int(os.getenv("HEDGE_MAX_ATTEMPTS", 3))
+MAX_OUTPUT_CHARS = int(os.getenv("HEDGE_MAX_OUTPUT_CHARS", 0))
+
+MIN_SAMPLES = 5
+
+metrics = {
+    "requests": 0,
+    "attempts_started": 0,
+    "attempts_cancelled": 0,
+    "first_won": 0,
+    "hedge_won": 0,
+    "retry_won": 0,
+    "failed": 0,
+    "attempt_errors": 0,
+    "budget_exhausted": 0,
+}
+
+# Winning attempt latencies per task, outlines and single pages don't take as long as whole bodies
+_latencies = {}
+
+
+def hedge_delay(task):
+    samples = _latencies.get(task, ())
+    if len(samples) < MIN_SAMPLES:
+        return DEFAULT_DELAY
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(len(ordered) * PERCENTILE / 100))
+    return ordered[index]
+
+
+class Budget:
+    # `reserved` keeps one first attempt for each of that many run_attempts calls
+    # sharing the budget, so hedges and retries of one call can't starve the rest
+
+    def __init__(self, max_attempts=MAX_ATTEMPTS, max_chars=MAX_OUTPUT_CHARS, reserved=0):
+        self.max_attempts = max_attempts
+        self.max_chars = max_chars
+        self.reserved = reserved
+        self.attempts = 0
+        self.chars = 0
+
+    @property
+    def exhausted(self):
+        return bool(self.max_chars) and self.chars >= self.max_chars
+
+    def can_start(self, first=False):
+        spare = self.reserved - 1 if first and self.reserved else self.reserved
+        return self.attempts + spare < self.max_attempts and not self.exhausted
+
+    def start(self, first=False):
+        if first and self.reserved:
+            self.reserved -= 1
+        self.attempts += 1
+
+    def spend(self, chars):
+        self.chars += chars
+        return not self.exhausted
+
+
+async def run_attempts(attempt, budget=None, strategy=STRATEGY, task="content"):
+    # attempt(number) returns a valid output or None. The first valid output
+    # wins and every other running attempt is cancelled. A budget shared by
+    # several calls caps the whole request.
+    budget = budget or Budget()
+    metrics["requests"] += 1
+    if not budget.can_start(first=True):
+        metrics["budget_exhausted"] += 1
+        metrics["failed"] += 1
+        return None
+
+    pending = {}
+
+    async def guarded(number):
+        try:
+            return await attempt(number)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            metrics["attempt_errors"] += 1
+            return None
+
+    def launch(kind):
+        budget.start(first=kind == "first")
+        metrics["attempts_started"] += 1
+        runner = asyncio.create_task(guarded(budget.attempts))
+        pending[runner] = (kind, time.perf_counter())
+
+    launch("first")
+    if strategy == "parallel":
+        for _ in range(PARALLEL - 1):
+            if budget.can_start():
+                launch("hedge")
+
+    try:
+        while pending:
+            timeout = None
+            if strategy == "hedged" and budget.can_start():
+                newest = max(started for _, started in pending.values())
+                timeout = max(0, newest + hedge_delay(task) - time.perf_counter())
+
+            done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+
+            if not done:
+                # Other calls sharing the budget may have spent it while this one waited
+                if budget.can_start():
+                    launch("hedge")
+                continue
+
+            for finished in done:
+                kind, started = pending.pop(finished)
+                output = finished.result()
+                if output is not None:
+                    _latencies.setdefault(task, deque(maxlen=200)).append(time.perf_counter() - started)
+                    metrics[f"{kind}_won"] += 1
+                    return output
+
+            if budget.exhausted:
+                metrics["budget_exhausted"] += 1
+                break
+
+            if not pending and budget.can_start():
+                launch("retry")
+
+        metrics["failed"] += 1
+        return None
+
+    finally:
+        for runner in pending:
+            runner.cancel()
+            metrics["attempts_cancelled"] += 1
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
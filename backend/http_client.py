@@ -0,0 +1,104 @@
+import asyncio
+import httpx
+from dotenv import load_dotenv
+
+load_dotenv()
+
+CONNECT_TIMEOUT = 10
+DEFAULT_TIMEOUT = 60
+CLIENT_TIMEOUT = httpx.Timeout(DEFAULT_TIMEOUT, connect=CONNECT_TIMEOUT)
+DEFAULT_HOST_LIMIT = 10
+
+# host: (max concurrent requests, read timeout in seconds)
+HOST_SETTINGS = {
+    "v2.convertapi.com": (8, 120),
+    "generativelanguage.googleapis.com": (16, 120),
+    "openrouter.ai": (16, 60),
+    "ir-api.myqa.cc": (8, 90),
+    # Local OpenAI-compatible stub used for offline load tests
+    "127.0.0.1": (256, 120),
+    "localhost": (256, 120),
+}
+
+_client = None
+
+
+class _ReleasingStream(httpx.AsyncByteStream):
+    # Holds the host permit until the body has been read or the response is closed
+
+    def __init__(self, stream, semaphore):
+        self._stream = stream
+        self._semaphore = semaphore
+        self._released = False
+
+    async def __aiter__(self):
+        async for chunk in self._stream:
+            yield chunk
+
+    async def aclose(self):
+        try:
+            await self._stream.aclose()
+        finally:
+            if not self._released:
+                self._released = True
+                self._semaphore.release()
+
+
+class HostLimitedTransport(httpx.AsyncHTTPTransport):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._semaphores = {}
+
+    def _semaphore(self, host):
+        if host not in self._semaphores:
+            limit = HOST_SETTINGS.get(host, (DEFAULT_HOST_LIMIT, DEFAULT_TIMEOUT))[0]
+            self._semaphores[host] = asyncio.Semaphore(limit)
+        return self._semaphores[host]
+
+    async def handle_async_request(self, request):
+        host = request.url.host
+        # Requests that set their own timeout keep it
+        if host in HOST_SETTINGS and request.extensions.get("timeout") in (None, CLIENT_TIMEOUT.as_dict()):
+            timeout = HOST_SETTINGS[host][1]
+            request.extensions["timeout"] = httpx.Timeout(timeout, connect=CONNECT_TIMEOUT).as_dict()
+
+        semaphore = self._semaphore(host)
+        await semaphore.acquire()
+        try:
+            response = await super().handle_async_request(request)
+        except BaseException:
+            semaphore.release()
+            raise
+        response.stream = _ReleasingStream(response.stream, semaphore)
+        return response
+
+
+def _build_client():
+    limits = httpx.Limits(max_connections=100, max_keepalive_connections=20, keepalive_expiry=30)
+    return httpx.AsyncClient(
+        transport=HostLimitedTransport(limits=limits, retries=1),
+        timeout=CLIENT_TIMEOUT,
+        follow_redirects=True,
+    )
+
+
+async def startup():
+    global _client
+    if _client is None:
+        _client = _build_client()
+
+
+async def shutdown():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+def get_http_client():
+    # Lazily created for scripts that call the pipeline without the app lifespan
+    global _client
+    if _client is None:
+        _client = _build_client()
+    return _client
+
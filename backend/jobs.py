@@ -0,0 +1,163 @@
+import asyncio
+import itertools
+import time
+from dotenv import load_dotenv
+import os
+from progress import KEEPALIVE_INTERVAL, sse_keepalive, sse_message, stream_with_keepalive
+
+load_dotenv()
+
+WORKERS = int(os.getenv("JOB_WORKERS", 4))
+# Queued (not yet running) jobs allowed before new submissions get a 429
+QUEUE_SIZE = int(os.getenv("JOB_QUEUE_SIZE", 32))
+USER_LIMIT = int(os.getenv("JOB_USER_LIMIT", 2))
+# Finished jobs stay available for polling and re-attaching this long
+RETENTION = int(os.getenv("JOB_RETENTION_SECONDS", 60 * 60))
+
+PRIORITIES = {"high": 0, "normal": 1, "low": 2}
+
+
+class JobRejected(Exception):
+    def __init__(self, message, retry_after=5):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class Job:
+    def __init__(self, job_id, user, priority, pipeline):
+        self.id = job_id
+        self.user = user
+        self.priority = priority
+        self.pipeline = pipeline
+        self.status = "queued"
+        self.result = None
+        self.events = []
+        self.created_at = time.time()
+        self.finished_at = None
+        self._changed = asyncio.Event()
+
+    @property
+    def finished(self):
+        return self.status in ("done", "failed")
+
+    def publish(self, event):
+        self.events.append(event)
+        if event.startswith("data: Done|"):
+            self.result = event[len("data: Done|"):].strip()
+        self._changed.set()
+
+    def finish(self, status):
+        self.status = status
+        self.finished_at = time.time()
+        self._changed.set()
+
+    async def stream(self, after=0):
+        # Replays events from index `after`, then follows the job until it finishes
+        index = after
+        while True:
+            while index < len(self.events):
+                yield self.events[index]
+                index += 1
+            if self.finished:
+                return
+            self._changed.clear()
+            await self._changed.wait()
+
+    def to_dict(self):
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "priority": self.priority,
+            "result": self.result,
+            "events": len(self.events),
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class JobManager:
+    def __init__(self, workers=WORKERS, queue_size=QUEUE_SIZE, user_limit=USER_LIMIT):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.user_limit = user_limit
+        self.jobs = {}
+        self._queue = asyncio.PriorityQueue()
+        self._order = itertools.count()
+        self._tasks = []
+
+    def start(self):
+        for _ in range(self.workers):
+            self._tasks.append(asyncio.create_task(self._worker()))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def check(self, user):
+        # Raises JobRejected when a submission from `user` would be turned away
+        self.prune()
+
+        if self._queue.qsize() >= self.queue_size:
+            raise JobRejected("Server is busy, please try again shortly")
+
+        active = sum(1 for job in self.jobs.values() if job.user == user and not job.finished)
+        if active >= self.user_limit:
+            raise JobRejected(f"Only {self.user_limit} generations can run at once", retry_after=15)
+
+    def submit(self, job_id, user, pipeline, priority="normal"):
+        # pipeline is a zero-argument callable returning an async generator of SSE events
+        self.check(user)
+
+        job = Job(job_id, user, priority, pipeline)
+        self.jobs[job_id] = job
+        self._queue.put_nowait((PRIORITIES.get(priority, PRIORITIES["normal"]), next(self._order), job))
+        job.publish(sse_message(f"Queued as job {job_id}"))
+        return job
+
+    def get(self, job_id):
+        return self.jobs.get(job_id)
+
+    def prune(self):
+        cutoff = time.time() - RETENTION
+        for job_id in [job_id for job_id, job in self.jobs.items() if job.finished and job.finished_at < cutoff]:
+            del self.jobs[job_id]
+
+    def stats(self):
+        statuses = [job.status for job in self.jobs.values()]
+        return {
+            "workers": self.workers,
+            "queued": statuses.count("queued"),
+            "running": statuses.count("running"),
+            "done": statuses.count("done"),
+            "failed": statuses.count("failed"),
+        }
+
+    async def _worker(self):
+        while True:
+            _, _, job = await self._queue.get()
+            job.status = "running"
+            try:
+                async for event in job.pipeline():
+                    job.publish(event)
+                failed = job.result is None or job.result.startswith("Error")
+                job.finish("failed" if failed else "done")
+            except asyncio.CancelledError:
+                job.finish("failed")
+                raise
+            except Exception as e:
+                print(f"Job {job.id} failed:", str(e))
+                job.publish(sse_message("Done|Error: Generation Failed, Please Try Again"))
+                job.finish("failed")
+            finally:
+                job.pipeline = None
+                self._queue.task_done()
+
+
+async def event_stream(job, after=0, interval=KEEPALIVE_INTERVAL):
+    async for event in stream_with_keepalive(job.stream(after), interval):
+        yield event if event is not None else sse_keepalive()
+
+
+manager = JobManager()
@@ -0,0 +1,76 @@
+from dotenv import load_dotenv
+from cache import DiskStore, LRUCache, content_key
+import os
+import re
+
+load_dotenv()
+
+# Off unless LLM_CACHE_ENABLED is set, since cached content repeats word for word
+ENABLED = os.getenv("LLM_CACHE_ENABLED", "").lower() in ("1", "true", "yes")
+TTL = int(os.getenv("LLM_CACHE_TTL_SECONDS", 60 * 60 * 24))
+MEMORY_BYTES = int(os.getenv("LLM_CACHE_MEMORY_MB", 32)) * 1024 * 1024
+
+# "memory" keeps responses for the life of the process, "disk" also survives restarts
+STORE = os.getenv("LLM_CACHE_STORE", "disk")
+CACHE_DIR = os.getenv("LLM_CACHE_DIR", "llm-cache")
+DISK_BYTES = int(os.getenv("LLM_CACHE_DISK_MB", 256)) * 1024 * 1024
+
+# Polished prompts are an intermediate step, so they are cached even when responses are not.
+# They hold user content, so they are kept in memory only and never written to CACHE_DIR.
+PROMPT_MEMORY_BYTES = int(os.getenv("LLM_PROMPT_CACHE_MEMORY_MB", 8)) * 1024 * 1024
+
+_cache = None
+_prompt_cache = None
+
+
+def build_store():
+    if STORE == "disk":
+        return DiskStore(CACHE_DIR, DISK_BYTES)
+    return None
+
+
+def get_cache():
+    global _cache
+    if _cache is None:
+        _cache = LRUCache(MEMORY_BYTES, ttl=TTL, store=build_store())
+    return _cache
+
+
+def get_prompt_cache():
+    global _prompt_cache
+    if _prompt_cache is None:
+        _prompt_cache = LRUCache(PROMPT_MEMORY_BYTES, ttl=TTL)
+    return _prompt_cache
+
+
+def normalize(text):
+    return re.sub(r"\s+", " ", text or "").strip()
+
+
+def response_key(skeleton, prompt, model, mode="html"):
+    return content_key(model, mode, normalize(skeleton), normalize(prompt))
+
+
+def get_response(key):
+    if not ENABLED:
+        return None
+    return get_cache().get(key)
+
+
+def store_response(key, llm_output):
+    # Callers only store outputs that already passed validation
+    if not ENABLED:
+        return
+    get_cache().set(key, llm_output)
+
+
+def polish_key(content, topic, tone):
+    return content_key("polish", normalize(content), normalize(topic), normalize(tone))
+
+
+def get_polished(key):
+    return get_prompt_cache().get(key)
+
+
+def store_polished(key, polished_prompt):
+    get_prompt_cache().set(key, polished_prompt)
@@ -0,0 +1,285 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+import openai # type: ignore
+from openai import AsyncOpenAI # type: ignore
+from dotenv import load_dotenv
+from http_client import get_http_client
+import os
+
+load_dotenv()
+
+GEMINI_BASE_URL = "https://generativelanguage.googleapis.com/v1beta/openai/"
+OPENROUTER_BASE_URL = "https://openrouter.ai/api/v1"
+
+# Points every task at an OpenAI-compatible server, e.g. benchmarks.llm_stub for offline load tests
+STUB_URL = os.getenv("LLM_STUB_URL")
+
+# Used when a 429 carries no Retry-After, and after connection errors and 5xx responses
+RATE_LIMIT_COOLDOWN = float(os.getenv("LLM_RATE_LIMIT_COOLDOWN", 10))
+FAILURE_COOLDOWN = float(os.getenv("LLM_FAILURE_COOLDOWN", 5))
+# Longest a request waits for a cooling-down provider when every provider is cooling down
+MAX_WAIT = float(os.getenv("LLM_MAX_WAIT", 30))
+
+LATENCY_SMOOTHING = 0.2
+
+HEADERS = {
+    "HTTP-Referer": "http://127.0.0.1:8000/"
+}
+
+
+class NoProviderAvailable(RuntimeError):
+    pass
+
+
+class TokenBucket:
+    # Requests per second with bursts of up to `burst` requests
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.capacity = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class Provider:
+    def __init__(self, name, base_url, api_key, rate, burst, concurrency):
+        self.name = name
+        self.base_url = base_url
+        self.api_key = api_key
+        self.bucket = TokenBucket(rate, burst)
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.cooldown_until = 0
+        # Smoothed seconds to a response per task, streams are timed to their first byte
+        self.latency = {}
+        self.in_flight = 0
+        self.requests = 0
+        self.failures = 0
+        self.rate_limited = 0
+        self._client = None
+        self._http = None
+
+    @property
+    def available(self):
+        return bool(self.api_key) and self.cooldown_until <= time.monotonic()
+
+    def client(self):
+        # Rebuilt only when the shared http client is replaced; retries are left to the router
+        http = get_http_client()
+        if self._client is None or self._http is not http:
+            self._client = AsyncOpenAI(
+                base_url=self.base_url,
+                api_key=self.api_key,
+                http_client=http,
+                max_retries=0,
+                default_headers=HEADERS,
+            )
+            self._http = http
+        return self._client
+
+    @asynccontextmanager
+    async def slot(self):
+        await self.bucket.acquire()
+        async with self.semaphore:
+            self.in_flight += 1
+            self.requests += 1
+            try:
+                yield
+            finally:
+                self.in_flight -= 1
+
+    def succeeded(self, task, seconds):
+        if task not in self.latency:
+            self.latency[task] = seconds
+        else:
+            self.latency[task] += LATENCY_SMOOTHING * (seconds - self.latency[task])
+
+    def failed(self, error):
+        self.failures += 1
+        if isinstance(error, openai.RateLimitError):
+            self.rate_limited += 1
+            cooldown = retry_after(error.response) or RATE_LIMIT_COOLDOWN
+        else:
+            cooldown = FAILURE_COOLDOWN
+        self.cooldown_until = max(self.cooldown_until, time.monotonic() + cooldown)
+        print(f"LLM provider {self.name} failed, cooling down for {cooldown:.1f}s:", str(error))
+
+    def stats(self):
+        return {
+            "in_flight": self.in_flight,
+            "requests": self.requests,
+            "failures": self.failures,
+            "rate_limited": self.rate_limited,
+            "latency": {task: round(seconds, 3) for task, seconds in self.latency.items()},
+            "cooling_down": round(max(0, self.cooldown_until - time.monotonic()), 1),
+        }
+
+
+def retry_after(response):
+    headers = response.headers if response is not None else {}
+    try:
+        if "retry-after-ms" in headers:
+            return float(headers["retry-after-ms"]) / 1000
+        return float(headers["retry-after"])
+    except (KeyError, ValueError):
+        return None
+
+
+def _provider(name, base_url, api_key, rate, burst, concurrency):
+    prefix = f"LLM_{name.upper().replace('-', '_')}"
+    return Provider(
+        name,
+        base_url,
+        api_key,
+        float(os.getenv(f"{prefix}_RPS", rate)),
+        int(os.getenv(f"{prefix}_BURST", burst)),
+        int(os.getenv(f"{prefix}_CONCURRENCY", concurrency)),
+    )
+
+
+if STUB_URL:
+    PROVIDERS = {"stub": _provider("stub", STUB_URL, "stub", 1000, 1000, 256)}
+    ROUTES = {task: [("stub", "stub")] for task in ("content", "layout", "polish", "rewrite")}
+else:
+    # The two OpenRouter keys are separate providers, each with its own rate limit
+    PROVIDERS = {
+        "gemini": _provider("gemini", GEMINI_BASE_URL, os.getenv("GEMINI_KEY"), 5, 10, 16),
+        "openrouter": _provider("openrouter", OPENROUTER_BASE_URL, os.getenv("OPENROUTER_API_KEY"), 0.3, 5, 8),
+        "openrouter-2": _provider("openrouter-2", OPENROUTER_BASE_URL, os.getenv("OPENROUTER_API_KEY_2"), 0.3, 5, 8),
+    }
+
+    # task: (provider, model) in order of preference, reordered by measured latency
+    ROUTES = {
+        "content": [
+            ("gemini", "gemini-2.5-flash"),
+            ("openrouter-2", "google/gemini-2.5-flash"),
+            ("openrouter", "google/gemini-2.5-flash"),
+        ],
+        "layout": [
+            ("gemini", "gemini-2.5-flash"),
+            ("openrouter-2", "google/gemini-2.5-flash"),
+        ],
+        "polish": [
+            ("openrouter-2", "meta-llama/llama-3.3-8b-instruct:free"),
+            ("openrouter", "meta-llama/llama-3.3-8b-instruct:free"),
+            ("gemini", "gemini-2.5-flash"),
+        ],
+        "rewrite": [
+            ("openrouter", "meta-llama/llama-3.3-8b-instruct:free"),
+            ("openrouter-2", "meta-llama/llama-3.3-8b-instruct:free"),
+            ("gemini", "gemini-2.5-flash"),
+        ],
+    }
+
+
+def candidates(task):
+    # Providers without a latency sample keep their place in the route so they get measured
+    route = [(PROVIDERS[name], model) for name, model in ROUTES[task]]
+    measured = [p.latency[task] for p, _ in route if task in p.latency]
+    default = min(measured) if measured else 0
+    ordered = sorted(
+        enumerate(route),
+        key=lambda item: (item[1][0].latency.get(task, default), item[0]),
+    )
+    return [entry for _, entry in ordered]
+
+
+async def _wait_for_provider(task):
+    route = [PROVIDERS[name] for name, _ in ROUTES[task] if PROVIDERS[name].api_key]
+    if not route:
+        raise NoProviderAvailable(f"No provider configured for {task}")
+    wait = min(p.cooldown_until for p in route) - time.monotonic()
+    if wait > MAX_WAIT:
+        raise NoProviderAvailable(f"Every provider for {task} is rate limited")
+    await asyncio.sleep(max(0, wait))
+
+
+def _should_fail_over(error):
+    if isinstance(error, (openai.RateLimitError, openai.APIConnectionError)):
+        return True
+    return isinstance(error, openai.APIStatusError) and error.status_code >= 500
+
+
+async def chat(task, messages, served=None, **kwargs):
+    # Same arguments and result as chat.completions.create, minus the model.
+    # The model that answered is appended to `served` when a list is passed.
+    last_error = None
+    for _ in range(2):
+        for provider, model in candidates(task):
+            if not provider.available:
+                continue
+            async with provider.slot():
+                started = time.perf_counter()
+                try:
+                    response = await provider.client().chat.completions.create(
+                        model=model, messages=messages, **kwargs
+                    )
+                except Exception as e:
+                    if not _should_fail_over(e):
+                        raise
+                    provider.failed(e)
+                    last_error = e
+                    continue
+            provider.succeeded(task, time.perf_counter() - started)
+            if served is not None:
+                served.append(model)
+            return response
+        await _wait_for_provider(task)
+    raise last_error or NoProviderAvailable(f"No provider answered for {task}")
+
+
+def primary_model(task):
+    return ROUTES[task][0][1]
+
+
+async def stream(task, messages, served=None, **kwargs):
+    # Yields content deltas. Fails over until the first response arrives,
+    # after that errors are raised to the caller. The model that answered is
+    # appended to `served` when a list is passed.
+    last_error = None
+    for _ in range(2):
+        for provider, model in candidates(task):
+            if not provider.available:
+                continue
+            async with provider.slot():
+                started = time.perf_counter()
+                try:
+                    response = await provider.client().chat.completions.create(
+                        model=model, messages=messages, stream=True, **kwargs
+                    )
+                except Exception as e:
+                    if not _should_fail_over(e):
+                        raise
+                    provider.failed(e)
+                    last_error = e
+                    continue
+                provider.succeeded(task, time.perf_counter() - started)
+                if served is not None:
+                    served.append(model)
+
+                # Closing this generator early closes the upstream stream as well
+                try:
+                    async for chunk in response:
+                        if chunk.choices and chunk.choices[0].delta.content:
+                            yield chunk.choices[0].delta.content
+                finally:
+                    await response.close()
+                return
+        await _wait_for_provider(task)
+    raise last_error or NoProviderAvailable(f"No provider answered for {task}")
+
+
+def stats():
+    return {name: provider.stats() for name, provider in PROVIDERS.items()}
@@ -0,0 +1,146 @@
+import asyncio
+import base64
+import html
+import re
+from collections import Counter
+from dotenv import load_dotenv
+import process_pools
+import os
+
+load_dotenv()
+
+# 0 converts in a thread of the server process, more runs conversions in a process pool
+WORKERS = int(os.getenv("LOCAL_CONVERTER_WORKERS", 0))
+
+PX_PER_PT = 96 / 72
+
+LIST_RE = re.compile(r"^\s*([•▪●–\-\*]|\d+[.)])\s+")
+
+
+def _px(value):
+    return round(value * PX_PER_PT, 2)
+
+
+def _box_style(bbox):
+    x0, y0, x1, y1 = bbox
+    return f"position:absolute;left:{_px(x0)}px;top:{_px(y0)}px;width:{_px(x1 - x0)}px;height:{_px(y1 - y0)}px;"
+
+
+def _inside(bbox, rects):
+    x0, y0, x1, y1 = bbox
+    cx, cy = (x0 + x1) / 2, (y0 + y1) / 2
+    return any(r[0] <= cx <= r[2] and r[1] <= cy <= r[3] for r in rects)
+
+
+def _body_size(pages):
+    sizes = Counter()
+    for page in pages:
+        for block in page["blocks"]:
+            for line in block.get("lines", []):
+                for span in line["spans"]:
+                    sizes[round(span["size"], 1)] += len(span["text"].strip())
+    return sizes.most_common(1)[0][0] if sizes else 11
+
+
+def _paragraph_class(text, size, bold, body_size, title_size, page_number, in_table):
+    # The same classes ConvertAPI emits and combine_text maps to placeholders
+    if in_table:
+        return "table-paragraph"
+    ratio = size / body_size
+    if page_number == 0 and size >= title_size and ratio >= 1.8:
+        return "title"
+    if ratio >= 1.6:
+        return "heading-1"
+    if ratio >= 1.3:
+        return "heading-2"
+    if ratio >= 1.1 or (bold and len(text) < 80):
+        return "heading-3"
+    if LIST_RE.match(text):
+        return "list-paragraph"
+    return "body-text"
+
+
+def pdf_to_html(pdf_path):
+    import pymupdf # type: ignore
+
+    # Opened from disk so pages are read lazily instead of holding the whole file
+    document = pymupdf.open(pdf_path, filetype="pdf")
+    pages = []
+    table_rects = []
+    for page in document:
+        pages.append(page.get_text("dict"))
+        try:
+            table_rects.append([tuple(table.bbox) for table in page.find_tables().tables])
+        except Exception:
+            table_rects.append([])
+
+    body_size = _body_size(pages)
+    first_page_sizes = [
+        span["size"] for block in pages[0]["blocks"] for line in block.get("lines", []) for span in line["spans"]
+    ] if pages else []
+    title_size = max(first_page_sizes, default=body_size)
+
+    out = [
+        "<!DOCTYPE html><html><head><meta charset=\"utf-8\"><style>",
+        ".page{position:relative;overflow:hidden;margin:0 auto;background:#fff}",
+        "p{margin:0;white-space:pre-wrap}",
+        "</style></head><body style=\"margin:0\"><div id=\"page-container\">",
+    ]
+
+    for number, page in enumerate(pages):
+        out.append(
+            f'<div class="page" id="pf{number + 1}" style="position:relative;'
+            f'width:{_px(page["width"])}px;height:{_px(page["height"])}px;">'
+        )
+
+        for block in page["blocks"]:
+            if block["type"] == 1:
+                ext = block.get("ext", "png")
+                data = base64.b64encode(block["image"]).decode("ascii")
+                out.append(f'<img src="data:image/{ext};base64,{data}" style="{_box_style(block["bbox"])}"/>')
+                continue
+
+            lines = [line for line in block.get("lines", []) if "".join(s["text"] for s in line["spans"]).strip()]
+            if not lines:
+                continue
+
+            spans = [span for line in lines for span in line["spans"] if span["text"].strip()]
+            text = " ".join(span["text"].strip() for span in spans)
+            size = max(span["size"] for span in spans)
+            first = spans[0]
+            bold = bool(first["flags"] & 16)
+            cls = _paragraph_class(text, size, bold, body_size, title_size, number, _inside(block["bbox"], table_rects[number]))
+
+            color = f'#{first["color"]:06x}'
+            y0, y1 = block["bbox"][1], block["bbox"][3]
+            out.append(f'<div class="block" style="{_box_style(block["bbox"])}">')
+            out.append(
+                f'<p class="p{number} {cls}" style="height:{_px(y1 - y0)}px;font-size:{round(size, 1)}pt;'
+                f'font-family:\'{first["font"]}\',sans-serif;color:{color};'
+                f'font-weight:{"bold" if bold else "normal"};">'
+            )
+            for line in lines:
+                line_text = "".join(span["text"] for span in line["spans"])
+                out.append(f"<span>{html.escape(line_text)} </span>")
+            out.append("</p></div>")
+
+        out.append("</div>")
+
+    out.append("</div></body></html>")
+    document.close()
+    return "".join(out)
+
+
+async def convert_pdf_to_html_local(pdf_path, filename):
+    try:
+        if WORKERS > 0:
+            loop = asyncio.get_running_loop()
+            html_string = await loop.run_in_executor(process_pools.get_pool("local_converter", WORKERS), pdf_to_html, pdf_path)
+        else:
+            html_string = await asyncio.to_thread(pdf_to_html, pdf_path)
+    except Exception as e:
+        print(f"Local conversion of {filename} failed:", str(e))
+        return False, str(e)
+
+    print("Conversion Successful")
+    return True, html_string
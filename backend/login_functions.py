@@ -2,7 +2,9 @@ from fastapi import Header, Request, HTTPException #type: ignore
 from fastapi.responses import JSONResponse #type: ignore
 from pydantic import BaseModel, EmailStr
 from supabase import create_client, Client #type: ignore
-import requests
+from http_client import get_http_client
+import hashlib
+import time
 import os
 import dotenv
 
@@ -15,6 +17,29 @@ service = os.getenv("SUPABASE_SERVICE_KEY")
 db: Client = create_client(url, key)  
 service_db: Client = create_client(url, service)
 
+# Verified token -> user id lookups are reused for this long, invalid tokens included
+USER_CACHE_TTL = int(os.getenv("USER_CACHE_TTL_SECONDS", 300))
+_verified_users = {}
+
+def verified_user_id(token):
+    # User id of a bearer token Supabase accepts, or None
+    digest = hashlib.sha256(token.encode("utf-8")).hexdigest()
+    now = time.time()
+    cached = _verified_users.get(digest)
+    if cached and cached[1] > now:
+        return cached[0]
+
+    try:
+        response = db.auth.get_user(token)
+        user_id = response.user.id if response and response.user else None
+    except Exception:
+        user_id = None
+
+    for stale in [d for d, (_, expires) in _verified_users.items() if expires <= now]:
+        del _verified_users[stale]
+    _verified_users[digest] = (user_id, now + USER_CACHE_TTL)
+    return user_id
+
 class LoginRequest(BaseModel):
     email: str
     password: str
@@ -80,7 +105,7 @@ class ResetPasswordRequest(BaseModel):
     access_token: str
     new_password: str
 
-def reset_password(req: ResetPasswordRequest):
+async def reset_password(req: ResetPasswordRequest):
     # Use Supabase Admin API to update the user password
     headers = {
         "apikey": service,
@@ -88,8 +113,10 @@ def reset_password(req: ResetPasswordRequest):
         "Content-Type": "application/json"
     }
 
+    client = get_http_client()
+
     # Get user info from token
-    user_info_res = requests.get(
+    user_info_res = await client.get(
         f"{url}/auth/v1/user",
         headers={
             "Authorization": f"Bearer {req.access_token}",
@@ -103,7 +130,7 @@ def reset_password(req: ResetPasswordRequest):
     user_id = user_info_res.json()["id"]
 
     # Update user password
-    update_res = requests.put(
+    update_res = await client.put(
         f"{url}/auth/v1/admin/users/{user_id}",
         headers=headers,
         json={"password": req.new_password}
@@ -4,29 +4,55 @@ import asyncio
 if sys.platform.startswith("win"):
     asyncio.set_event_loop_policy(asyncio.WindowsProactorEventLoopPolicy())
 
-from fastapi import FastAPI, Request, Form, File, UploadFile # type: ignore
-from fastapi.responses import StreamingResponse, FileResponse, JSONResponse # type: ignore
+from fastapi import FastAPI, Request, Form, File, UploadFile, HTTPException # type: ignore
+from fastapi.responses import StreamingResponse, JSONResponse, Response, FileResponse # type: ignore
 from fastapi.staticfiles import StaticFiles # type: ignore
 from fastapi.middleware.cors import CORSMiddleware # type: ignore
+from contextlib import asynccontextmanager
 from pydantic import BaseModel
-from typing import Optional
+from typing import List, Optional
 import json
-import asyncio
-from login_functions import LoginRequest, ResetPasswordRequest, ResetRequest, signup, login, reset_password, request_password_reset 
-from generate_template import convert_pdf_to_html, clean_html, convert_html_to_pdf
-from generate_content import (
-    get_content,
-    build_prompt,
-    add_images_and_styles_with_content,
-    remove_images_and_styles,
-    write_output,
-    check_output,
-    no_template_generation
-)
-from editor_functions import transformText, generate_image
-from db_functions import save_draft, get_newsletters, get_all_versions, delete_files, update_file
-
-app = FastAPI()
+import os
+from login_functions import LoginRequest, ResetPasswordRequest, ResetRequest, signup, login, reset_password, request_password_reset, verified_user_id
+from generate_template import convert_html_to_pdf
+import process_pools
+from editor_functions import transformText, transform_batch, generate_image, generate_images, image_metrics, IMAGE_MAX_VARIANTS, IMAGE_MAX_PROMPTS, TEXT_BATCH_MAX_REQUEST_BLOCKS
+from pipeline import templated_pipeline, untemplated_pipeline
+from progress import sse_event, sse_message
+import browser_pool
+import http_client
+import workspace
+import assets
+import template_cache
+import llm_cache
+import rewrite_cache
+import export_cache
+import hedging
+import llm_router
+import jobs
+from db_functions import save_draft, get_newsletters, get_all_versions, delete_files, update_file, thumbnail_queue
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await http_client.startup()
+    try:
+        await browser_pool.pool.start()
+    except Exception as e:
+        print("Browser pool not started, will retry on first use:", str(e))
+    jobs.manager.start()
+    thumbnail_queue.start()
+    gc_task = asyncio.create_task(workspace.gc_loop())
+    health_task = asyncio.create_task(browser_pool.pool.health_loop())
+    yield
+    gc_task.cancel()
+    health_task.cancel()
+    await jobs.manager.stop()
+    await thumbnail_queue.stop()
+    process_pools.shutdown_pools()
+    await browser_pool.pool.stop()
+    await http_client.shutdown()
+
+app = FastAPI(lifespan=lifespan)
 
 # Mount static file route
 
@@ -38,7 +64,10 @@ class NoCacheStaticFiles(StaticFiles):
         response.headers["Expires"] = "0"
         return response
 
-app.mount("/html", NoCacheStaticFiles(directory="generated-html"), name="html")
+os.makedirs(workspace.HTML_ROOT, exist_ok=True)
+
+# Generated files are served per job as /html/<job_id>/output.html
+app.mount("/html", NoCacheStaticFiles(directory=workspace.HTML_ROOT), name="html")
 
 # Allow CORS from your frontend (adjust origin as needed)
 app.add_middleware(
@@ -47,6 +76,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Job-ID", "ETag"],
 )
 
 @app.post("/signup")
@@ -60,175 +90,271 @@ def set_login(request: LoginRequest):
     return login(request)
 
 @app.post("/reset-password")
-def forgot_password(req: ResetPasswordRequest):
+async def forgot_password(req: ResetPasswordRequest):
     print('reset password req recieved')
-    return reset_password(req)
+    return await reset_password(req)
 
 @app.post("/request-password-reset")
 async def set_request_reset(payload: ResetRequest, request: Request):
     print("reset password email req")
     return await request_password_reset(payload, request)
 
-@app.post("/generate")
-async def generate_newsletter(
-    topic: str = Form(...),
-    content: Optional[str] = Form(None),
-    tone: Optional[str] = Form(None),
-    pdfTemplate: Optional[UploadFile] = File(None),
-):
-    if(pdfTemplate):
-        pdfBytes = await pdfTemplate.read()
-
-        async def generate():
-            yield "data: Received content...\n\n"
-            await asyncio.sleep(1)
-            print("Received topic:", topic)
-            print("Received content:", content)
-            print("Received tone:", tone if tone else "None")
-
-            if not pdfTemplate:
-                print("No PDF template uploaded.")
-                yield "data: No PDF template uploaded\n\n"
-                await asyncio.sleep(1)
-                yield "data: Done|Error: No Template\n\n"
-                await asyncio.sleep(1)
-
-            else:
-
-                file_name = f"generated-html/{pdfTemplate.filename[:-4]}"
-
-                print("STARTING WITH", pdfTemplate.filename)
-                yield f"data: Starting with {pdfTemplate.filename}\n\n"
-                await asyncio.sleep(1)
+async def user_key(request: Request):
+    # Signed-in users are limited per verified user id, anyone else per address
+    token = request.headers.get("authorization")
+    if token and token.startswith("Bearer "):
+        user_id = await asyncio.to_thread(verified_user_id, token[7:])
+        if user_id:
+            return f"user:{user_id}"
+    return request.client.host if request.client else "anonymous"
 
-                data = await convert_pdf_to_html(pdfBytes, pdfTemplate.filename)
-                if not data[0]:
-                    print("Step One: Conversion Failed")
-                    yield "data: Done|Error: Could Not Convert Template"
-                    return
+def rejected(e):
+    return HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
 
-                print("Step One: Converted pdf to html")
-                yield "data: Step 1: Converted pdf to html\n\n"
-                await asyncio.sleep(1)
-
-                cleaned_file = clean_html(file_name)
-
-                print("Step Two: Converted html to template")
-                yield "data: Step 2: Converted html to template\n\n"
-                await asyncio.sleep(1)
-
-                template, img_srcs, all_styles = remove_images_and_styles(cleaned_file)
-
-                print("Step Three: Preprocessed template for prompting")
-                yield "data: Step 3: Preprocessed template for prompting\n\n"
-                await asyncio.sleep(1)
-
-                final_prompt = build_prompt(topic, content, tone)
-                print("Step Four: Built prompt from from inputs")
-                yield "data: Step 4: Built prompt from from inputs\n\n"
-                await asyncio.sleep(1)
-
-                attempts = 0
-                while attempts < 3:
-
-                    llm_output = get_content(template, final_prompt)
-
-                    if check_output(llm_output, len(all_styles)):
-                        print("Step Five: Recieved content from llm")
-                        yield "data: Step 5: Recieved content from llm\n\n"
-                        await asyncio.sleep(1)
-                        break
-
-                    else:
-                        attempts += 1
-                        if(attempts < 3):
-                            print("Step Five: Improper Output, Trying Again...")
-                            yield "data: Step 5: Improper Output, Trying Again...\n\n"
-                            await asyncio.sleep(1)
-
-                if attempts == 3:
-
-                    yield "data: LLM failed after 3 attempts.\n\n"
-                    await asyncio.sleep(1)
-                    yield "data: Done|Error: Content Generation Failure, Please Try Again\n\n"
-                    await asyncio.sleep(1)
-                    return
+async def remove_uploads_after(job_id, events):
+    # The uploaded pdf is only needed while its job runs
+    try:
+        async for event in events:
+            yield event
+    finally:
+        workspace.remove_uploads(job_id)
 
-                else:
-                    template = add_images_and_styles_with_content(
-                        template, llm_output, img_srcs, all_styles
-                    )
+async def submit_generation_job(request, topic, content, tone, pdfTemplate, fresh, priority):
+    job_id = workspace.new_job_id()
+    user = await user_key(request)
 
-                    print("Step Six: Readded removed images and styles")
+    if not pdfTemplate and not content:
+        raise HTTPException(status_code=400, detail="Provide content when no pdf template is uploaded")
 
-                    yield "data: Step 6: Readded removed images and styles\n\n"
-                    await asyncio.sleep(1)
+    # Turned away before the upload is copied to disk
+    try:
+        jobs.manager.check(user)
+    except jobs.JobRejected as e:
+        raise rejected(e)
 
-                    write_output(template)
+    if pdfTemplate:
+        filename = pdfTemplate.filename
 
-                    print("Step Seven: Created Output File")
+        # Spooled upload is copied to disk in chunks, never read into memory whole
+        try:
+            pdfPath, pdfDigest = await workspace.save_upload(pdfTemplate, job_id)
+        except workspace.UploadTooLarge as e:
+            raise HTTPException(status_code=413, detail=str(e))
 
-                    yield "data: Step 7: Created Output File\n\n"
-                    await asyncio.sleep(1)
-                    yield "data: Done|output.html\n\n"
-                    await asyncio.sleep(1)
-                    
-                    return
-            
-        return StreamingResponse(generate(), media_type="text/event-stream")
+        pipeline = lambda: remove_uploads_after(
+            job_id, templated_pipeline(job_id, pdfPath, pdfDigest, filename, topic, content, tone, fresh)
+        )
     else:
-        
-        no_template_generation(content, topic, tone)
+        pipeline = lambda: untemplated_pipeline(job_id, topic, content, tone, fresh)
 
-        return JSONResponse(
-            content = {"message": "Done"}
-        )
+    # Checked again, other jobs may have been queued while the upload was copied
+    try:
+        return jobs.manager.submit(job_id, user, pipeline, priority)
+    except jobs.JobRejected as e:
+        workspace.remove_job(job_id)
+        raise rejected(e)
+
+@app.post("/generate")
+async def generate_newsletter(
+    request: Request,
+    topic: str = Form(...),
+    content: Optional[str] = Form(None),
+    tone: Optional[str] = Form(None),
+    pdfTemplate: Optional[UploadFile] = File(None),
+    fresh: bool = Form(False),
+):
+    # Both paths run as queued jobs, so generation never holds up the request handler
+    job = await submit_generation_job(request, topic, content, tone, pdfTemplate, fresh, "normal")
+
+    return StreamingResponse(
+        jobs.event_stream(job),
+        media_type="text/event-stream",
+        headers={"X-Job-ID": job.id}
+    )
+
+@app.post("/jobs")
+async def submit_job(
+    request: Request,
+    topic: str = Form(...),
+    content: Optional[str] = Form(None),
+    tone: Optional[str] = Form(None),
+    pdfTemplate: Optional[UploadFile] = File(None),
+    fresh: bool = Form(False),
+):
+    # Background submissions are polled, so they give way to streamed generations
+    job = await submit_generation_job(request, topic, content, tone, pdfTemplate, fresh, "low")
+    return JSONResponse(status_code=202, content=job.to_dict())
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = jobs.manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.to_dict()
+
+@app.get("/jobs/{job_id}/events")
+async def get_job_events(job_id: str, after: int = 0):
+    # Clients re-attach after a dropped connection by passing the number of events already seen
+    job = jobs.manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return StreamingResponse(jobs.event_stream(job, after), media_type="text/event-stream")
+
+@app.get("/metrics")
+async def get_metrics():
+    return {
+        "jobs": jobs.manager.stats(),
+        "hedging": hedging.metrics,
+        "llm_providers": llm_router.stats(),
+        "template_cache": template_cache.get_cache().stats(),
+        "llm_cache": llm_cache.get_cache().stats(),
+        "export_cache": export_cache.get_store().stats(),
+        "rewrite_cache": rewrite_cache.stats(),
+        "images": image_metrics,
+        "browser": browser_pool.pool.stats(),
+        "thumbnails": thumbnail_queue.stats(),
+    }
 
 @app.post("/export")
 async def get_pdf_download(request: Request):
 
     try:
         data = await request.json()
-        html_content = data.get("html")
-
     except (json.decoder.JSONDecodeError):
-        html_path = f"generated-html/output.html"
+        data = {}
+
+    html_content = data.get("html")
+    job_id = data.get("job_id")
+
+    if job_id is not None and not workspace.is_job_id(job_id):
+        raise HTTPException(status_code=400, detail="Invalid job id")
+
+    if not html_content:
+        if job_id is None:
+            raise HTTPException(status_code=400, detail="Missing html or job id")
+
+        html_path = workspace.output_html_path(job_id)
+        if not os.path.exists(html_path):
+            raise HTTPException(status_code=404, detail="Job output not found")
 
         with open(html_path, "r", encoding="utf-8") as f:
             html_content = f.read()
 
-    done = await convert_html_to_pdf(html_content)
+    # The ETag is the content hash, so a client holding it already has this exact pdf
+    key = await asyncio.to_thread(export_cache.export_key, html_content)
+    etag = f'"{key}"'
+    if etag in [tag.strip() for tag in request.headers.get("if-none-match", "").split(",")]:
+        return Response(status_code=304, headers={"ETag": etag})
+
+    try:
+        done = await export_cache.export_pdf(key, html_content, convert_html_to_pdf)
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=503, detail="Export queue is full, please try again", headers={"Retry-After": "10"})
 
     if not done[0]:
         return done[1]
-    
+
     return FileResponse(
-                path="generated-pdf/output.pdf",
+                done[1],
+                media_type="application/pdf",
                 filename="output.pdf",
-                media_type="application/pdf"
+                headers={"ETag": etag, "Cache-Control": "private, no-cache"}
             )
 
 class TransformTextReq(BaseModel):
     text: str
     tone: str
     custom_prompt: Optional[str] = None
+    fresh: bool = False
 
 @app.post("/text")
-async def change_tone(req: TransformTextReq):
+async def change_tone(req: TransformTextReq, request: Request):
     text = req.text
     tone = req.tone
     custom_prompt = req.custom_prompt
-    transformed_text = transformText(text, tone, custom_prompt)
+    transformed_text = await transformText(text, tone, custom_prompt, await user_key(request), req.fresh)
     return {"transformed": transformed_text}
 
+class TextBlock(BaseModel):
+    id: str
+    text: str
+
+class TransformBatchReq(BaseModel):
+    blocks: List[TextBlock]
+    tone: str
+    custom_prompt: Optional[str] = None
+    fresh: bool = False
+
+@app.post("/text/batch")
+async def change_tone_batch(req: TransformBatchReq, request: Request):
+    # Streams one "block" event per block as its packed request finishes
+    if not 1 <= len(req.blocks) <= TEXT_BATCH_MAX_REQUEST_BLOCKS:
+        raise HTTPException(status_code=400, detail=f"Send 1 to {TEXT_BATCH_MAX_REQUEST_BLOCKS} blocks")
+    blocks = [(block.id, block.text) for block in req.blocks]
+
+    user = await user_key(request)
+
+    async def events():
+        async for block_id, transformed, error in transform_batch(blocks, req.tone, req.custom_prompt, user, req.fresh):
+            payload = {"id": block_id, "transformed": transformed}
+            if transformed is None:
+                payload["error"] = error or "Empty response"
+            yield sse_event("block", payload)
+        yield sse_message("Done")
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
 class GenerateReq(BaseModel):
     prompt: str
 
 @app.post("/image")
 async def get_ai_image(req: GenerateReq):
     prompt = req.prompt
-    img_dict = generate_image(prompt)
-    return JSONResponse(content=img_dict)
+    asset = await generate_image(prompt)
+    url, variants = assets.asset_urls(asset)
+    return JSONResponse(content={
+        "url": url,
+        "mime_type": asset["mime_type"],
+        "width": asset["width"],
+        "height": asset["height"],
+        "variants": variants,
+    })
+
+class GenerateImagesReq(BaseModel):
+    prompts: List[str]
+    variants: int = 1
+
+@app.post("/images")
+async def get_ai_images(req: GenerateImagesReq):
+    # Every prompt and variant is generated at once, each streamed as an "image" event when ready
+    if not 1 <= len(req.prompts) <= IMAGE_MAX_PROMPTS or not 1 <= req.variants <= IMAGE_MAX_VARIANTS:
+        raise HTTPException(status_code=400, detail=f"Send 1 to {IMAGE_MAX_PROMPTS} prompts and 1 to {IMAGE_MAX_VARIANTS} variants")
+    async def events():
+        async for index, variant, asset, error in generate_images(req.prompts, req.variants):
+            payload = {"prompt": index, "variant": variant}
+            if asset is None:
+                payload["error"] = error
+            else:
+                url, variants = assets.asset_urls(asset)
+                payload.update({"url": url, "mime_type": asset["mime_type"], "width": asset["width"], "height": asset["height"], "variants": variants})
+            yield sse_event("image", payload)
+        yield sse_message("Done")
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+@app.get("/assets/{digest}.{ext}")
+async def get_asset(digest: str, ext: str):
+    path = assets.find_asset(digest, ext)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Asset not found")
+    return FileResponse(path, media_type=assets.MIME_TYPES[ext], headers={"Cache-Control": assets.CACHE_CONTROL})
+
+@app.get("/assets/{digest}/{width}.{fmt}")
+async def get_asset_variant(digest: str, width: int, fmt: str):
+    path = await asyncio.to_thread(assets.variant, digest, width, fmt)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Asset not found")
+    return FileResponse(path, media_type=assets.VARIANT_FORMATS[fmt][1], headers={"Cache-Control": assets.CACHE_CONTROL})
 
 @app.post("/save-draft")
 async def save(request: Request):
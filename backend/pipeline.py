@@ -0,0 +1,294 @@
+import asyncio
+from generate_template import convert_pdf_to_html, clean_html
+from generate_content import (
+    content_prompt,
+    stream_attempt,
+    TagCounter,
+    build_prompt,
+    add_images_and_styles_with_content,
+    restore_images_and_styles,
+    extract_slots,
+    slot_prompt,
+    parse_slot_output,
+    fill_slots,
+    remove_images_and_styles,
+    write_output,
+    parse_output,
+    check_output_body,
+    split_pages,
+    outline_prompt,
+    parse_outline,
+    page_prompt,
+    parse_page_output,
+    parse_pages_output,
+    CONTENT_MODE,
+    PAGE_CONCURRENCY,
+    PLACEHOLDER_RE,
+    StyleChecker,
+    polish_content,
+    layout_prompt,
+    clean_html_string,
+    isHTML
+)
+import json
+import template_cache
+import llm_cache
+import hedging
+import llm_router
+from progress import QUEUE_DONE, StageTimer, drain_queue, sse_event, sse_message
+
+
+def pages_budget(template):
+    # One first attempt for the outline and each page with text slots,
+    # plus the usual retries and hedges shared across all of them
+    calls = 1 + sum(1 for page in split_pages(template) if page.find_all(string=PLACEHOLDER_RE))
+    return hedging.Budget(max_attempts=calls + hedging.MAX_ATTEMPTS - 1, reserved=calls)
+
+
+async def generate_pages(template, final_prompt, events, timer, budget, served):
+    # Writes an outline of the whole newsletter, then every page against it at
+    # the same time. Each page is checked and retried on its own, so one bad
+    # page does not throw away the others. Every attempt draws on the one
+    # request budget. Returns (output, pages) or None.
+    pages = split_pages(template)
+    slots = extract_slots(template)
+
+    async def outline_attempt(number):
+        output = await stream_attempt(outline_prompt(slots, final_prompt), {"type": "json_object"}, None, budget, lambda _: None, served=served)
+        return parse_outline(output, slots) if output is not None else None
+
+    outline = await hedging.run_attempts(outline_attempt, budget, task="outline")
+    if outline is None:
+        events.put_nowait(timer.event("Step 5: Could not outline the newsletter"))
+        return None
+    events.put_nowait(timer.event("Step 5: Outlined the newsletter"))
+
+    semaphore = asyncio.Semaphore(PAGE_CONCURRENCY)
+
+    async def generate(number, page):
+        num_tags = len(page.find_all()) + 1
+        if not page.find_all(string=PLACEHOLDER_RE):
+            # Nothing to write on pages without text slots
+            return str(page), parse_page_output(str(page), num_tags)
+
+        prompt = page_prompt(page, number, len(pages), outline, final_prompt)
+
+        async def attempt(attempt_number):
+            on_delta = lambda delta: events.put_nowait(
+                sse_event("content", {"page": number, "attempt": attempt_number, "text": delta})
+            )
+            async with semaphore:
+                output = await stream_attempt(prompt, None, None, budget, on_delta, served=served)
+
+            if output is not None:
+                checked = parse_page_output(output, num_tags)
+                if checked is not None:
+                    return output, checked
+            events.put_nowait(timer.event(f"Step 5: Improper Output for page {number} on attempt {attempt_number}"))
+            return None
+
+        result = await hedging.run_attempts(attempt, budget, task="page")
+        if result is not None:
+            events.put_nowait(timer.event(f"Step 5: Wrote page {number} of {len(pages)}"))
+        return result
+
+    tasks = [asyncio.create_task(generate(number, page)) for number, page in enumerate(pages, start=1)]
+    try:
+        pending = set(tasks)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            if any(task.result() is None for task in done):
+                return None
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    results = [task.result() for task in tasks]
+    return json.dumps([output for output, _ in results]), [checked for _, checked in results]
+
+
+async def templated_pipeline(job_id, pdf_path, pdf_digest, filename, topic, content, tone, fresh=False):
+    # Yields the SSE events for one templated generation, ending with a Done| message
+    timer = StageTimer()
+    yield timer.event("Received content...")
+    print("Received topic:", topic)
+    print("Received content:", content)
+    print("Received tone:", tone if tone else "None")
+
+    yield timer.event(f"Starting with {filename}")
+
+    cache_key = template_cache.template_key(pdf_digest)
+    cached = await asyncio.to_thread(template_cache.load_template, cache_key)
+
+    if cached:
+        template, img_srcs, all_styles = cached
+        yield timer.event("Step 1-3: Loaded cached template")
+
+    else:
+        converted, raw_html = await convert_pdf_to_html(pdf_path, filename)
+        if not converted:
+            print("Step One: Conversion Failed")
+            yield sse_message("Done|Error: Could Not Convert Template")
+            return
+
+        yield timer.event("Step 1: Converted pdf to html")
+
+        cleaned = await asyncio.to_thread(clean_html, raw_html, job_id)
+        cleaned_html = str(cleaned)
+        yield timer.event("Step 2: Converted html to template")
+
+        # Strips the cleaned tree in place, no re-parse
+        template, img_srcs, all_styles = await asyncio.to_thread(remove_images_and_styles, cleaned)
+        await asyncio.to_thread(
+            template_cache.store_template, cache_key, cleaned_html, template, img_srcs, all_styles
+        )
+        yield timer.event("Step 3: Preprocessed template for prompting")
+
+    final_prompt = build_prompt(topic, content, tone)
+    yield timer.event("Step 4: Built prompt from from inputs")
+
+    # validate returns the parsed output (filled slots or body tag) or None,
+    # so the output that passes is never parsed a second time
+    if CONTENT_MODE == "slots":
+        slots = extract_slots(template)
+        prompt = slot_prompt(slots, final_prompt)
+        response_format = {"type": "json_object"}
+        validate = lambda output: parse_slot_output(output, slots)
+    elif CONTENT_MODE == "pages":
+        validate = lambda output: parse_pages_output(output, split_pages(template))
+    else:
+        prompt = content_prompt(template, final_prompt)
+        response_format = None
+
+        def validate(output):
+            output_body = parse_output(output)
+            if output_body is not None and check_output_body(output_body, len(all_styles)):
+                return output_body
+            return None
+
+    # Keyed by the route's primary model; answers from a fallback model are not cached
+    primary_model = llm_router.primary_model("content")
+    response_key = llm_cache.response_key(str(template.body), final_prompt, primary_model, CONTENT_MODE)
+    llm_output = None
+    parsed = None
+    if not fresh:
+        llm_output = await asyncio.to_thread(llm_cache.get_response, response_key)
+        parsed = validate(llm_output) if llm_output else None
+
+    if parsed is not None:
+        yield timer.event("Step 5: Loaded cached content")
+
+    else:
+        events = asyncio.Queue()
+        budget = pages_budget(template) if CONTENT_MODE == "pages" else hedging.Budget()
+        served = []
+
+        async def attempt(number):
+            # Tag counting only applies when the model echoes the html body
+            monitor = TagCounter(len(all_styles)) if CONTENT_MODE != "slots" else None
+            on_delta = lambda delta: events.put_nowait(
+                sse_event("content", {"attempt": number, "text": delta})
+            )
+            output = await stream_attempt(prompt, response_format, monitor, budget, on_delta, served=served)
+
+            if output is not None:
+                checked = validate(output)
+                if checked is not None:
+                    return output, checked
+            events.put_nowait(timer.event(f"Step 5: Improper Output on attempt {number}"))
+            return None
+
+        if CONTENT_MODE == "pages":
+            runner = asyncio.create_task(generate_pages(template, final_prompt, events, timer, budget, served))
+        else:
+            runner = asyncio.create_task(hedging.run_attempts(attempt, budget, task=CONTENT_MODE))
+        runner.add_done_callback(lambda _: events.put_nowait(QUEUE_DONE))
+        try:
+            async for event in drain_queue(events):
+                yield event
+        finally:
+            runner.cancel()
+        result = runner.result()
+
+        if result is None:
+            if CONTENT_MODE == "pages":
+                yield timer.event(f"LLM failed to write every page after {budget.attempts} attempts.")
+            else:
+                yield timer.event(f"LLM failed after {budget.attempts} attempts.")
+            yield sse_message("Done|Error: Content Generation Failure, Please Try Again")
+            return
+
+        llm_output, parsed = result
+        if set(served) <= {primary_model}:
+            await asyncio.to_thread(llm_cache.store_response, response_key, llm_output)
+        yield timer.event("Step 5: Recieved content from llm")
+
+    if CONTENT_MODE == "slots":
+        template = fill_slots(template, parsed, slots)
+        template = restore_images_and_styles(template, img_srcs, all_styles)
+    else:
+        template = add_images_and_styles_with_content(
+            template, parsed, img_srcs, all_styles
+        )
+    yield timer.event("Step 6: Readded removed images and styles")
+
+    await asyncio.to_thread(write_output, template, job_id)
+    yield timer.event("Step 7: Created Output File")
+    yield sse_message(f"Done|{job_id}/output.html")
+
+
+async def untemplated_pipeline(job_id, topic, content, tone, fresh=False):
+    # Yields the SSE events for a generation without a pdf template, ending with a Done| message
+    timer = StageTimer()
+    yield timer.event("Received content...")
+
+    polish_key = llm_cache.polish_key(content, topic, tone)
+    polished = None if fresh else await asyncio.to_thread(llm_cache.get_polished, polish_key)
+    if polished:
+        yield timer.event("Step 1: Loaded cached prompt")
+    else:
+        try:
+            polished = await polish_content(content, topic, tone)
+        except Exception as e:
+            print("Polishing failed:", str(e))
+            yield sse_message("Done|Error: Could Not Prepare Prompt, Please Try Again")
+            return
+        await asyncio.to_thread(llm_cache.store_polished, polish_key, polished)
+        yield timer.event("Step 1: Polished prompt")
+
+    prompt = layout_prompt(polished)
+    events = asyncio.Queue()
+    budget = hedging.Budget()
+
+    async def attempt(number):
+        on_delta = lambda delta: events.put_nowait(
+            sse_event("content", {"attempt": number, "text": delta})
+        )
+        output = await stream_attempt(prompt, None, StyleChecker(), budget, on_delta, task="layout")
+
+        if output is not None:
+            html_string = clean_html_string(output)
+            if isHTML(html_string):
+                return html_string
+        events.put_nowait(timer.event(f"Step 2: Improper Output on attempt {number}"))
+        return None
+
+    runner = asyncio.create_task(hedging.run_attempts(attempt, budget, task="layout"))
+    runner.add_done_callback(lambda _: events.put_nowait(QUEUE_DONE))
+    try:
+        async for event in drain_queue(events):
+            yield event
+    finally:
+        runner.cancel()
+    html_string = runner.result()
+
+    if html_string is None:
+        yield timer.event(f"LLM failed after {budget.attempts} attempts.")
+        yield sse_message("Done|Error: Content Generation Failure, Please Try Again")
+        return
+    yield timer.event("Step 2: Generated layout")
+
+    await asyncio.to_thread(write_output, html_string, job_id)
+    yield timer.event("Step 3: Created Output File")
+    yield sse_message(f"Done|{job_id}/output.html")
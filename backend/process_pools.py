@@ -0,0 +1,23 @@
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+_pools = {}
+_lock = threading.Lock()
+
+
+def get_pool(name, workers):
+    # Callers run in worker threads, so two requests may ask for a pool at once
+    with _lock:
+        if name not in _pools:
+            # Spawned, never forked: the server process runs threads (uvicorn, playwright, httpx)
+            _pools[name] = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+        return _pools[name]
+
+
+def shutdown_pools():
+    with _lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.shutdown(cancel_futures=True)
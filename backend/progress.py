@@ -0,0 +1,64 @@
+import asyncio
+import json
+import time
+
+KEEPALIVE_INTERVAL = 5
+
+QUEUE_DONE = object()
+
+
+class StageTimer:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stage_started = self.started
+
+    def event(self, message):
+        now = time.perf_counter()
+        stage = now - self.stage_started
+        total = now - self.started
+        self.stage_started = now
+        print(f"{message} (stage {stage:.2f}s, total {total:.2f}s)")
+        return f"data: {message} (stage {stage:.2f}s, total {total:.2f}s)\n\n"
+
+
+def sse_message(message):
+    return f"data: {message}\n\n"
+
+
+def sse_event(event, payload):
+    return f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+
+
+def sse_keepalive():
+    return ": keepalive\n\n"
+
+
+async def stream_with_keepalive(stream, interval=KEEPALIVE_INTERVAL):
+    # Re-yields items from an async iterator, yielding None as a keepalive
+    # marker whenever the next item takes longer than interval to arrive.
+    iterator = stream.__aiter__()
+    while True:
+        task = asyncio.ensure_future(iterator.__anext__())
+        try:
+            while True:
+                done, _ = await asyncio.wait({task}, timeout=interval)
+                if done:
+                    break
+                yield None
+        finally:
+            if not task.done():
+                task.cancel()
+        try:
+            item = task.result()
+        except StopAsyncIteration:
+            return
+        yield item
+
+
+async def drain_queue(queue):
+    # Yields queued SSE strings until QUEUE_DONE is put on the queue
+    while True:
+        item = await queue.get()
+        if item is QUEUE_DONE:
+            return
+        yield item
@@ -0,0 +1,65 @@
+import threading
+from collections import OrderedDict
+from dotenv import load_dotenv
+from cache import LRUCache, content_key
+from llm_cache import normalize
+import os
+
+load_dotenv()
+
+# Editor rewrites are memoized per user, so toggling between tones or undoing
+# and redoing a rewrite does not call the llm again
+TTL = int(os.getenv("REWRITE_CACHE_TTL_SECONDS", 60 * 60))
+USER_BYTES = int(os.getenv("REWRITE_CACHE_USER_KB", 256)) * 1024
+# Least recently active users are dropped past this many
+MAX_USERS = int(os.getenv("REWRITE_CACHE_USERS", 1000))
+
+_users = OrderedDict()
+_lock = threading.Lock()
+
+metrics = {
+    "hits": 0,
+    "misses": 0,
+    "fresh": 0,
+}
+
+
+def rewrite_key(text, tone, custom_prompt, model):
+    # The custom prompt is only used with the Custom tone
+    prompt = custom_prompt if tone == 'Custom' else None
+    return content_key("rewrite", model, normalize(text), normalize(tone), normalize(prompt))
+
+
+def user_cache(user):
+    user = user or "anonymous"
+    with _lock:
+        cache = _users.get(user)
+        if cache is None:
+            cache = LRUCache(USER_BYTES, ttl=TTL)
+            _users[user] = cache
+            while len(_users) > MAX_USERS:
+                _users.popitem(last=False)
+        _users.move_to_end(user)
+        return cache
+
+
+def get_rewrite(user, key):
+    rewritten = user_cache(user).get(key)
+    metrics["hits" if rewritten is not None else "misses"] += 1
+    return rewritten
+
+
+def store_rewrite(user, key, rewritten):
+    user_cache(user).set(key, rewritten)
+
+
+def stats():
+    with _lock:
+        caches = list(_users.values())
+    sizes = [cache.stats() for cache in caches]
+    return {
+        **metrics,
+        "users": len(caches),
+        "entries": sum(size["entries"] for size in sizes),
+        "bytes": sum(size["bytes"] for size in sizes),
+    }
@@ -0,0 +1,47 @@
+from bs4 import BeautifulSoup
+from dotenv import load_dotenv
+from cache import DiskStore, LRUCache, content_key
+from generate_template import HTML_PARSER, PDF_CONVERTER
+import os
+
+load_dotenv()
+
+CACHE_DIR = os.getenv("TEMPLATE_CACHE_DIR", "template-cache")
+MEMORY_BYTES = int(os.getenv("TEMPLATE_CACHE_MEMORY_MB", 64)) * 1024 * 1024
+DISK_BYTES = int(os.getenv("TEMPLATE_CACHE_DISK_MB", 512)) * 1024 * 1024
+
+# Bump when clean_raw_html or remove_images_and_styles change their output
+CACHE_VERSION = "1"
+
+_cache = None
+
+
+def get_cache():
+    global _cache
+    if _cache is None:
+        _cache = LRUCache(MEMORY_BYTES, store=DiskStore(CACHE_DIR, DISK_BYTES))
+    return _cache
+
+
+def template_key(pdf_digest, converter=PDF_CONVERTER):
+    # Keyed on the sha256 computed while the upload was saved, the pdf is never loaded whole
+    return content_key(CACHE_VERSION, converter, pdf_digest)
+
+
+def load_template(key):
+    entry = get_cache().get(key)
+    if entry is None:
+        return None
+
+    # Parsed fresh on every hit since the pipeline mutates the template tree
+    template = BeautifulSoup(entry["skeleton"], HTML_PARSER)
+    return template, list(entry["img_srcs"]), list(entry["all_styles"])
+
+
+def store_template(key, cleaned_html, template, img_srcs, all_styles):
+    get_cache().set(key, {
+        "cleaned_html": cleaned_html,
+        "skeleton": str(template),
+        "img_srcs": img_srcs,
+        "all_styles": all_styles,
+    })
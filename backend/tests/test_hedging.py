@@ -0,0 +1,31 @@
+import asyncio
+import hedging
+
+
+def test_concurrent_hedges_respect_shared_budget(monkeypatch):
+    monkeypatch.setattr(hedging, "DEFAULT_DELAY", 0.01)
+    budget = hedging.Budget(max_attempts=6, reserved=4)
+
+    async def slow(number):
+        await asyncio.sleep(0.1)
+        return number
+
+    async def main():
+        return await asyncio.gather(*(
+            hedging.run_attempts(slow, budget, strategy="hedged", task="test-page") for _ in range(4)
+        ))
+
+    results = asyncio.run(main())
+    assert all(result is not None for result in results)
+    assert budget.attempts <= budget.max_attempts
+
+
+def test_failed_attempts_are_counted_not_printed(capsys):
+    before = hedging.metrics["attempt_errors"]
+
+    async def broken(number):
+        raise RuntimeError("upstream error")
+
+    assert asyncio.run(hedging.run_attempts(broken, hedging.Budget(max_attempts=2))) is None
+    assert hedging.metrics["attempt_errors"] == before + 2
+    assert capsys.readouterr().out == ""
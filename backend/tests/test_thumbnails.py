@@ -0,0 +1,80 @@
+import asyncio
+from thumbnails import ThumbnailQueue
+
+
+def run_queue(saves, render_seconds=0.1, window=0.05):
+    # saves: [(delay before the save, html)] for a single project
+    rendering = []
+    overlapped = []
+    finished = []
+
+    async def render(proj_id, html, token):
+        if rendering:
+            overlapped.append(html)
+        rendering.append(html)
+        await asyncio.sleep(render_seconds)
+        rendering.remove(html)
+        finished.append(html)
+
+    async def main():
+        queue = ThumbnailQueue(render, workers=2, window=window)
+        queue.start()
+        for delay, html in saves:
+            await asyncio.sleep(delay)
+            queue.submit("p", html, "token")
+        await asyncio.sleep(window + render_seconds * 3)
+        status = queue.status("p")
+        stats = queue.stats()
+        await queue.stop()
+        return status, stats
+
+    status, stats = asyncio.run(main())
+    return finished, overlapped, status, stats
+
+
+def test_saves_within_window_render_latest_once():
+    finished, overlapped, status, stats = run_queue([(0, "v1"), (0.01, "v2"), (0.01, "v3")])
+    assert finished == ["v3"]
+    assert status == "ready"
+    assert stats["coalesced"] == 2
+
+
+def test_save_during_render_waits_for_it():
+    finished, overlapped, status, stats = run_queue([(0, "v1"), (0.1, "v2")], render_seconds=0.3)
+    assert overlapped == []
+    assert finished == ["v1", "v2"]
+    assert status == "ready"
+
+
+def test_failed_render_is_reported():
+    async def render(proj_id, html, token):
+        raise RuntimeError("render failed")
+
+    async def main():
+        queue = ThumbnailQueue(render, workers=1, window=0.01)
+        queue.submit("p", "v1", "token")
+        await asyncio.sleep(0.05)
+        status = queue.status("p")
+        await queue.stop()
+        return status
+
+    assert asyncio.run(main()) == "failed"
+
+
+def test_render_results_are_counted_separately():
+    results = iter(["rendered", "unchanged", "deleted"])
+
+    async def render(proj_id, html, token):
+        return next(results)
+
+    async def main():
+        queue = ThumbnailQueue(render, workers=1, window=0.01)
+        for proj_id in ("a", "b", "c"):
+            queue.submit(proj_id, "html", "token")
+        await asyncio.sleep(0.05)
+        stats = queue.stats()
+        await queue.stop()
+        return stats
+
+    stats = asyncio.run(main())
+    assert (stats["rendered"], stats["unchanged"], stats["deleted"]) == (1, 1, 1)
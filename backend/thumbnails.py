@@ -0,0 +1,162 @@
+import asyncio
+import hashlib
+import time
+from io import BytesIO
+from PIL import Image
+from dotenv import load_dotenv
+import os
+
+load_dotenv()
+
+# Pages are rendered at this width and clipped to a fixed aspect instead of the full page
+RENDER_WIDTH = int(os.getenv("THUMBNAIL_RENDER_WIDTH", 800))
+ASPECT = float(os.getenv("THUMBNAIL_ASPECT", 1.25))
+RENDER_HEIGHT = round(RENDER_WIDTH * ASPECT)
+
+# Stored sizes: "list" for dashboard cards, "detail" for the newsletter page
+SIZES = {"list": int(os.getenv("THUMBNAIL_LIST_WIDTH", 320)), "detail": int(os.getenv("THUMBNAIL_DETAIL_WIDTH", 640))}
+FORMATS = {"webp": ("WEBP", "image/webp"), "jpeg": ("JPEG", "image/jpeg")}
+QUALITY = int(os.getenv("THUMBNAIL_QUALITY", 75))
+
+# Object names carry the html hash, so a stored thumbnail never changes under its url
+CACHE_CONTROL = "31536000"
+
+# Results of a render call
+RENDERED = "rendered"
+UNCHANGED = "unchanged"
+DELETED = "deleted"
+
+WORKERS = int(os.getenv("THUMBNAIL_WORKERS", 2))
+# Saves of the same project within this window are rendered once, from the latest html
+COALESCE_WINDOW = float(os.getenv("THUMBNAIL_COALESCE_SECONDS", 5))
+# Finished states are forgotten after this long; a missing state means the stored thumbnail is current
+STATE_RETENTION = int(os.getenv("THUMBNAIL_STATE_RETENTION_SECONDS", 60 * 60))
+
+
+def thumbnail_key(html):
+    # Changing the render settings re-renders every project on its next save
+    settings = f"{RENDER_WIDTH}x{RENDER_HEIGHT}:{sorted(SIZES.items())}:{QUALITY}"
+    return hashlib.sha256(f"{settings}\n{html}".encode("utf-8")).hexdigest()
+
+
+def thumbnail_prefix(proj_id, key):
+    return f"{proj_id}/{key[:16]}"
+
+
+def thumbnail_files(path):
+    # Rows saved before sized thumbnails point at a single png
+    if path.endswith(".png"):
+        return [path]
+    return [f"{path}/{name}.{fmt}" for name in SIZES for fmt in FORMATS]
+
+
+def encode_thumbnails(screenshot):
+    # Returns {(size name, format): bytes}, downscaled from one screenshot
+    encoded = {}
+    with Image.open(BytesIO(screenshot)) as image:
+        image = image.convert("RGB")
+        for name, width in SIZES.items():
+            resized = image.resize((width, round(width * ASPECT)), Image.LANCZOS)
+            for fmt, (pil_format, _) in FORMATS.items():
+                output_buffer = BytesIO()
+                resized.save(output_buffer, format=pil_format, quality=QUALITY, optimize=True)
+                encoded[(name, fmt)] = output_buffer.getvalue()
+    return encoded
+
+
+class ThumbnailQueue:
+    # Renders and uploads project thumbnails in the background. render(proj_id, html, token)
+    # does the work and returns RENDERED, UNCHANGED when the stored thumbnail already
+    # matches the html, or DELETED when the project is gone; only the newest html
+    # submitted for a project is ever rendered.
+
+    def __init__(self, render, workers=WORKERS, window=COALESCE_WINDOW):
+        self.render = render
+        self.workers = workers
+        self.window = window
+        self.coalesced = 0
+        self.results = {RENDERED: 0, UNCHANGED: 0, DELETED: 0}
+        self._latest = {}
+        self._scheduled = set()
+        self._running = set()
+        self._states = {}
+        self._queue = None
+        self._tasks = []
+
+    def start(self):
+        if self._tasks:
+            return
+        self._queue = asyncio.Queue()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def submit(self, proj_id, html, token):
+        if not self._tasks:
+            self.start()
+        if proj_id in self._latest:
+            self.coalesced += 1
+        self._latest[proj_id] = (html, token)
+        self._set_state(proj_id, "pending")
+
+        # A project already waiting out its window picks up this html when it runs,
+        # one that is rendering is scheduled again once its render finishes
+        if proj_id not in self._scheduled and proj_id not in self._running:
+            self._schedule(proj_id)
+
+    def _schedule(self, proj_id):
+        self._scheduled.add(proj_id)
+        asyncio.get_running_loop().call_later(self.window, self._queue.put_nowait, proj_id)
+
+    def status(self, proj_id):
+        state = self._states.get(proj_id)
+        return state["status"] if state else None
+
+    def _set_state(self, proj_id, status):
+        self._states[proj_id] = {"status": status, "updated_at": time.time()}
+
+    def prune(self):
+        cutoff = time.time() - STATE_RETENTION
+        for proj_id, state in list(self._states.items()):
+            if state["status"] != "pending" and state["updated_at"] < cutoff:
+                del self._states[proj_id]
+
+    async def _worker(self):
+        while True:
+            proj_id = await self._queue.get()
+            self._scheduled.discard(proj_id)
+            html, token = self._latest.pop(proj_id)
+            self._running.add(proj_id)
+
+            try:
+                result = await self.render(proj_id, html, token)
+                if result in self.results:
+                    self.results[result] += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Thumbnail for {proj_id} failed:", str(e))
+                if proj_id not in self._latest:
+                    self._set_state(proj_id, "failed")
+            else:
+                # A save that came in during the render keeps the project pending
+                if proj_id not in self._latest:
+                    self._set_state(proj_id, "ready")
+            finally:
+                self._running.discard(proj_id)
+            if proj_id in self._latest:
+                self._schedule(proj_id)
+            self.prune()
+
+    def stats(self):
+        statuses = [state["status"] for state in self._states.values()]
+        return {
+            "pending": statuses.count("pending"),
+            "failed": statuses.count("failed"),
+            "coalesced": self.coalesced,
+            **self.results,
+        }
@@ -0,0 +1,118 @@
+import asyncio
+import hashlib
+import os
+import shutil
+import time
+import uuid
+from dotenv import load_dotenv
+import assets
+
+load_dotenv()
+
+HTML_ROOT = "generated-html"
+# Uploaded templates and converter downloads, kept out of the public /html mount
+UPLOAD_ROOT = "uploads"
+
+CHUNK_SIZE = 1024 * 1024
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_MB", 100)) * 1024 * 1024
+
+# Completed jobs are kept this long before their artifacts are removed
+JOB_TTL = int(os.getenv("JOB_TTL_SECONDS", 60 * 60 * 24))
+GC_INTERVAL = 60 * 30
+
+# Intermediate html is kept in memory; set to also write it into the job folder
+DEBUG_ARTIFACTS = os.getenv("DEBUG_ARTIFACTS", "").lower() in ("1", "true", "yes")
+
+
+def new_job_id():
+    return uuid.uuid4().hex
+
+
+def is_job_id(job_id):
+    if not isinstance(job_id, str) or len(job_id) != 32:
+        return False
+    try:
+        uuid.UUID(hex=job_id)
+    except ValueError:
+        return False
+    return True
+
+
+def job_dir(job_id, root=HTML_ROOT):
+    if not is_job_id(job_id):
+        raise ValueError(f"Invalid job id: {job_id}")
+    path = os.path.join(root, job_id)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def output_html_path(job_id):
+    return os.path.join(job_dir(job_id), "output.html")
+
+
+def upload_path(job_id, name):
+    return os.path.join(job_dir(job_id, UPLOAD_ROOT), name)
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+async def save_upload(upload, job_id, name="template.pdf"):
+    # Copies the upload's spool to the job folder chunk by chunk, hashing as it goes
+    path = upload_path(job_id, name)
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with open(path, "wb") as f:
+            while chunk := await upload.read(CHUNK_SIZE):
+                size += len(chunk)
+                if size > MAX_UPLOAD_BYTES:
+                    raise UploadTooLarge(f"Uploads are limited to {MAX_UPLOAD_BYTES // (1024 * 1024)} MB")
+                digest.update(chunk)
+                await asyncio.to_thread(f.write, chunk)
+    except BaseException:
+        remove_job(job_id)
+        raise
+    return path, digest.hexdigest()
+
+
+def remove_uploads(job_id):
+    shutil.rmtree(os.path.join(UPLOAD_ROOT, job_id), ignore_errors=True)
+
+
+def remove_job(job_id):
+    for root in (HTML_ROOT, UPLOAD_ROOT):
+        shutil.rmtree(os.path.join(root, job_id), ignore_errors=True)
+
+
+def write_debug_artifact(job_id, name, text):
+    if not DEBUG_ARTIFACTS:
+        return
+    with open(os.path.join(job_dir(job_id), name), "w", encoding="utf-8") as f:
+        f.write(text)
+
+
+def collect_garbage(max_age=JOB_TTL):
+    cutoff = time.time() - max_age
+    removed = 0
+    for root in (HTML_ROOT, UPLOAD_ROOT):
+        if not os.path.isdir(root):
+            continue
+        for name in os.listdir(root):
+            path = os.path.join(root, name)
+            if not (is_job_id(name) and os.path.isdir(path)):
+                continue
+            if os.path.getmtime(path) < cutoff:
+                shutil.rmtree(path, ignore_errors=True)
+                removed += 1
+    if removed:
+        print(f"Removed {removed} expired job workspaces")
+    return removed
+
+
+async def gc_loop(interval=GC_INTERVAL):
+    while True:
+        await asyncio.to_thread(collect_garbage)
+        await asyncio.to_thread(assets.collect_garbage)
+        await asyncio.sleep(interval)
@@ -28,7 +28,7 @@ function EditorPage() {
   useEffect(() => {
 
     const func = async() => {
-        await fetch('http://127.0.0.1:8000/html/output.html')
+        await fetch(`http://127.0.0.1:8000/html/${localStorage.getItem('jobID')}/output.html`)
         .then(res => res.text())
         .then(setHtmlContent)
         .catch(console.error);
@@ -78,6 +78,13 @@ function EditorPage() {
       return;
     }
 
+    // A selection holding several text blocks is rewritten in one batch request
+    const textBlocks = collectTextBlocks(selectedComponent);
+    if (textBlocks.length > 1) {
+      await handleBatchTransform(textBlocks);
+      return;
+    }
+
     try {
       setLoading(true); // start loading
 
@@ -105,6 +112,69 @@ function EditorPage() {
     }
   };
 
+  const collectTextBlocks = (component) => {
+    if (component.is('text')) return [component];
+    return component.components().models.flatMap(collectTextBlocks);
+  };
+
+  const handleBatchTransform = async (textBlocks) => {
+    const byId = {};
+    const blocks = textBlocks
+      .map((component) => {
+        byId[component.getId()] = component;
+        return { id: component.getId(), text: component.view?.el?.innerText || '' };
+      })
+      .filter((block) => block.text.trim());
+
+    try {
+      setLoading(true);
+
+      const response = await fetch('http://127.0.0.1:8000/text/batch', {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({
+          blocks,
+          tone: tone === 'Custom Tone' ? 'Custom' : tone,
+          custom_prompt: customPrompt,
+        }),
+      });
+
+      if (!response.ok || !response.body) throw new Error('Server error');
+
+      // Each block is replaced as soon as its rewrite streams in
+      const reader = response.body.getReader();
+      const decoder = new TextDecoder('utf-8');
+      let buffered = '';
+      let failed = 0;
+
+      while (true) {
+        const { done, value } = await reader.read();
+        if (done) break;
+
+        buffered += decoder.decode(value, { stream: true });
+        const events = buffered.split('\n\n');
+        buffered = events.pop();
+
+        for (const event of events) {
+          if (!event.startsWith('event: block')) continue;
+          const block = JSON.parse(event.slice(event.indexOf('data: ') + 6));
+          if (block.transformed) {
+            byId[block.id]?.components([{ type: 'text', content: block.transformed }]);
+          } else {
+            failed += 1;
+          }
+        }
+      }
+
+      if (failed) alert(`${failed} blocks could not be rewritten.`);
+      closeModal();
+    } catch (err) {
+      alert('Failed to transform text: ' + err.message);
+    } finally {
+      setLoading(false);
+    }
+  };
+
   const handleImageGeneration = async () => {
     if (!imagePrompt.trim()) {
       alert('Please enter an image prompt.');
@@ -122,10 +192,11 @@ function EditorPage() {
 
       if (!response.ok) throw new Error('Image generation failed');
 
-      const { image_base64, mime_type } = await response.json();
-      const dataUrl = `data:${mime_type};base64,${image_base64}`;
+      // Images are referenced by a relative /assets URL so drafts do not carry the image bytes
+      // or a backend host; the dev server proxies it and exports inline it
+      const { url } = await response.json();
 
-      selectedImageComponent.addAttributes({ src: dataUrl });
+      selectedImageComponent.addAttributes({ src: url });
       closeImageModal();
     } catch (err) {
       alert('Image generation error: ' + err.message);
@@ -4,6 +4,7 @@ import Sidebar from "../components/Sidebar.js";
 import SessionDialogBox from "../components/SessionoverBox.js";
 import "./Home.css";
 import { useQuery, useQueryClient } from '@tanstack/react-query';
+import { pollWhilePending } from "../utils/thumbnails.js";
 
 const fetchNewsletters = async (type, setShowSessionDialog) => {
   const token = localStorage.getItem("authToken");
@@ -42,6 +43,7 @@ function HomePage() {
     queryFn: () => fetchNewsletters('Draft', setShowSessionDialog),
     staleTime: Infinity,
     cacheTime: Infinity,
+    refetchInterval: pollWhilePending,
   });
 
   const {
@@ -53,6 +55,7 @@ function HomePage() {
     queryFn: () => fetchNewsletters('Published', setShowSessionDialog),
     staleTime: Infinity,
     cacheTime: Infinity,
+    refetchInterval: pollWhilePending,
   });
 
   const {
@@ -64,6 +67,7 @@ function HomePage() {
     queryFn: () => fetchNewsletters('Archive', setShowSessionDialog),
     staleTime: Infinity,
     cacheTime: Infinity,
+    refetchInterval: pollWhilePending,
   });
 
   useEffect(() => {
@@ -88,7 +92,9 @@ function HomePage() {
           navigate(`/newsletter/${item.file_id}`);
         }}
       >
-        {item.thumbnail_url && (
+        {item.thumbnail_status === "pending" ? (
+          <div className="card-thumbnail thumbnail-placeholder">Preview updating…</div>
+        ) : item.thumbnail_url && (
           <img
             src={item.thumbnail_url}
             alt={`${item.file_name} thumbnail`}
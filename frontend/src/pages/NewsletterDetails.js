@@ -18,7 +18,9 @@ function NewsletterDetailPage() {
 
   const newsletterData = queryClient.getQueryData(['newsletters', status]);
 
-  const thumbnail = newsletterData?.find(f => f.file_id === file_id).thumbnail_url;
+  const latestFile = newsletterData?.find(f => f.file_id === file_id);
+  const thumbnail = latestFile?.thumbnail_urls?.detail?.webp || latestFile?.thumbnail_url;
+  const thumbnailPending = latestFile?.thumbnail_status === "pending";
   console.log("thumbnail:", thumbnail)
 
   useEffect(() => {
@@ -177,7 +179,9 @@ function NewsletterDetailPage() {
 
   const renderLatestFileInfo = (file) => (
     <div className="latest-file">
-      {thumbnail && (
+      {thumbnailPending ? (
+        <div className="thumbnail-img thumbnail-placeholder">Preview updating…</div>
+      ) : thumbnail && (
         <img
           src={thumbnail}
           alt="Thumbnail"
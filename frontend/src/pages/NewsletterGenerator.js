@@ -1,4 +1,4 @@
-import React, { useState } from "react";
+import React, { useState, useRef } from "react";
 import { useNavigate } from "react-router-dom";
 import "./NewsletterGenerator.css";
 import Sidebar from "../components/Sidebar.js";
@@ -11,6 +11,7 @@ function NewsletterGenerator() {
   const [htmlFilePath, setHtmlFilePath] = useState(null);
   const [progress, setProgress] = useState("");
   const [loading, setLoading] = useState(false);
+  const lastExport = useRef({ etag: null, blob: null });
   const navigate = useNavigate();
 
   const handleFileChange = (e) => {
@@ -45,45 +46,38 @@ function NewsletterGenerator() {
         throw new Error("Failed to connect to the backend.");
       }
 
-      if (pdfTemplate){
-        const reader = response.body.getReader();
-        const decoder = new TextDecoder("utf-8");
-        let resultText = "";
-
-        while (true) {
-          const { done, value } = await reader.read();
-          if (done) break;
-
-          const chunk = decoder.decode(value, { stream: true });
-          resultText += chunk;
-
-          const messages = resultText.split("\n\n").filter(Boolean);
-          for (let msg of messages) {
-            if (msg.startsWith("data: ")) {
-              const data = msg.replace("data: ", "").trim();
-              setProgress(data);
-
-              if (data.startsWith("Done|")) {
-                const parts = data.split("|");
-                const filename = parts[1];
-                if (filename && !filename.startsWith("Error")) {
-                  setHtmlFilePath(`http://127.0.0.1:8000/html/${filename}`);
-                }
-                setLoading(false);
-                return;
+      // Templated and template-free generations both stream progress events
+      const reader = response.body.getReader();
+      const decoder = new TextDecoder("utf-8");
+      let buffered = "";
+
+      while (true) {
+        const { done, value } = await reader.read();
+        if (done) break;
+
+        // Only complete events are handled, a partial one waits for the next chunk
+        buffered += decoder.decode(value, { stream: true });
+        const messages = buffered.split("\n\n");
+        buffered = messages.pop();
+
+        for (let msg of messages) {
+          if (msg.startsWith("data: ")) {
+            const data = msg.replace("data: ", "").trim();
+            setProgress(data);
+
+            if (data.startsWith("Done|")) {
+              const parts = data.split("|");
+              const filename = parts[1];
+              if (filename && !filename.startsWith("Error")) {
+                localStorage.setItem('jobID', filename.split("/")[0]);
+                setHtmlFilePath(`http://127.0.0.1:8000/html/${filename}`);
               }
+              setLoading(false);
+              return;
             }
           }
         }
       }
-      else{
-        const data = await response.json();
-        if(data.message === 'Done'){
-          setHtmlFilePath(`http://127.0.0.1:8000/html/output.html`);
-        }
-        setProgress(data.message);
-        setLoading(false);
-      }
       
     } catch (error) {
       console.error("Error:", error.message);
@@ -101,15 +95,23 @@ function NewsletterGenerator() {
     const response = await fetch("http://127.0.0.1:8000/export", {
       method: "POST",
       headers: {
-        "Content-Type": "application/json"
-      }
+        "Content-Type": "application/json",
+        // Unchanged newsletters come back as 304 and reuse the last download
+        ...(lastExport.current.etag && { "If-None-Match": lastExport.current.etag })
+      },
+      body: JSON.stringify({ job_id: localStorage.getItem('jobID') })
     });
 
-    if (!response.ok) {
+    let blob;
+    if (response.status === 304 && lastExport.current.blob) {
+      blob = lastExport.current.blob;
+    } else if (response.ok) {
+      blob = await response.blob();
+      lastExport.current = { etag: response.headers.get("ETag"), blob };
+    } else {
       throw new Error("Failed to export PDF.");
     }
 
-    const blob = await response.blob();
     const downloadUrl = window.URL.createObjectURL(blob);
 
     const a = document.createElement("a");
@@ -4,6 +4,7 @@ import Sidebar from "../components/Sidebar.js";
 import SessionDialogBox from "../components/SessionoverBox.js";
 import "./Home.css";
 import { useQuery, useQueryClient } from '@tanstack/react-query';
+import { pollWhilePending } from "../utils/thumbnails.js";
 
 function NewsletterListPage({ type, label }) {
   const navigate = useNavigate();
@@ -36,6 +37,7 @@ function NewsletterListPage({ type, label }) {
     },
     staleTime: Infinity,
     cacheTime: Infinity,
+    refetchInterval: pollWhilePending,
   });
 
    useEffect(() => {
@@ -70,7 +72,9 @@ function NewsletterListPage({ type, label }) {
                 className="card clickable"
                 onClick={() => handleCardClick(item.file_id)}
               >
-                {item.thumbnail_url && (
+                {item.thumbnail_status === "pending" ? (
+                  <div className="card-thumbnail thumbnail-placeholder">Preview updating…</div>
+                ) : item.thumbnail_url && (
                   <img
                     src={item.thumbnail_url}
                     alt={`${item.file_name} thumbnail`}
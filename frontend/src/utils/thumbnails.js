@@ -0,0 +1,3 @@
+// Poll until every queued thumbnail has been rendered
+export const pollWhilePending = (query) =>
+  query.state.data?.some((item) => item.thumbnail_status === "pending") ? 3000 : false;